@@ -9,6 +9,9 @@ Apache License, Version 2.0 as detailed in the accompanying README.txt.
 """
 import argparse
 from adventuregpt.loop import Loop
+from adventuregpt.output import OUTPUT_BACKENDS
+from adventuregpt.providers import PROVIDERS, OpenAIProvider
+from adventuregpt.ratelimit import RateLimiter
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -16,16 +19,121 @@ if __name__ == '__main__':
         description="The game ADVENTURE played by ChatGPT"
     )
     parser.add_argument("-w", "--walkthrough_path")
-    parser.add_argument("-o", "--output_path")
+    parser.add_argument("-j", "--walkthrough_workers", type=int, default=4,
+                        help="number of walkthrough chunks to process at once")
+    parser.add_argument("-o", "--output_path", default="game_output.jsonl",
+                        help="JSONL file the game history is streamed to")
     parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("-c", "--cache_path",
+                        help="sqlite file used to cache and replay LLM responses")
+    parser.add_argument("--cache_size", type=int, default=10000,
+                        help="maximum number of cached responses to keep")
+    parser.add_argument("-p", "--provider", choices=PROVIDERS.keys(), default="openai",
+                        help="model provider; 'fake' plays from a script without calling any service")
+    parser.add_argument("-t", "--max_turns", type=int,
+                        help="stop after this many player turns")
+    parser.add_argument("--prioritization_window", type=int, default=10,
+                        help="number of tasks sent for ranking when new tasks are inserted")
+    parser.add_argument("--rerank_every", type=int, default=10,
+                        help="re-rank the whole task list every N updates, 0 to always re-rank")
+    parser.add_argument("--max_tasks", type=int, default=50,
+                        help="maximum number of pending tasks kept when playing without a walkthrough")
+    parser.add_argument("--no_rules", dest="completion_rules", action="store_false",
+                        help="always ask the LLM whether a task is complete")
+    parser.add_argument("--no_navigation", dest="navigation", action="store_false",
+                        help="don't walk to known destinations locally, always ask the player agent")
+    parser.add_argument("-s", "--seed", type=int,
+                        help="random seed for the game, recorded in the history for replays")
+    parser.add_argument("--checkpoint_path",
+                        help="file the loop state is saved to every --checkpoint_every turns")
+    parser.add_argument("--checkpoint_every", type=int, default=5)
+    parser.add_argument("-r", "--resume", dest="resume_path",
+                        help="pick a game back up from a checkpoint file")
+    parser.add_argument("-d", "--display", choices=OUTPUT_BACKENDS.keys(), default="baud",
+                        help="how game text is drawn: instant, buffered or the retro baud effect")
+    parser.add_argument("--requests_per_minute", type=float,
+                        help="most LLM requests to make per minute")
+    parser.add_argument("--tokens_per_minute", type=float,
+                        help="most prompt and completion tokens to use per minute")
+    parser.add_argument("--max_concurrent_calls", type=int,
+                        help="most LLM calls to have in flight at once")
+    parser.add_argument("--max_retries", type=int, default=6,
+                        help="retries per LLM call, with jittered exponential backoff")
+    parser.add_argument("--api_base",
+                        help="alternative OpenAI API endpoint, e.g. a local stub server")
+    parser.add_argument("--metrics_every", type=int, default=0,
+                        help="print a one line timing and token summary every N turns")
+    parser.add_argument("--profile", action="store_true",
+                        help="print per agent and per phase timing percentiles when the game ends")
+    parser.add_argument("--metrics_path",
+                        help="JSON file the timing, token and cost metrics are written to")
+    parser.add_argument("--memory_tokens", type=int, default=600,
+                        help="token budget for the recent game history in prompts, older moves are summarized")
+    parser.add_argument("--recall", type=int, default=3,
+                        help="number of relevant past game outputs shown to the player, 0 to turn off")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream the player's response and act on each command as soon as it arrives")
+    parser.add_argument("--commands_per_turn", type=int, default=1,
+                        help="when streaming, commands to take from the player before cancelling the rest")
+    parser.add_argument("--fused", action="store_true",
+                        help="play each turn with one LLM call that judges the task, adds tasks and picks the command")
+    parser.add_argument("--stuck_window", type=int, default=12,
+                        help="recent game states checked for loops, 0 to turn loop detection off")
+    parser.add_argument("--stuck_repeats", type=int, default=3,
+                        help="times a state has to recur within the window to count as a loop")
+    parser.add_argument("--speculate", type=int, default=0,
+                        help="ask the player for this many candidate commands and try each on a copy of the game first")
+    parser.add_argument("--no_validation", dest="validate_commands", action="store_false",
+                        help="send the player's lines to the game as they are, without checking the vocabulary")
     args = parser.parse_args()
 
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute,
+                          args.max_concurrent_calls, args.max_retries)
+    if args.provider == "openai":
+        # retries are left to the limiter so that every agent backs off together
+        provider = OpenAIProvider(api_base=args.api_base, max_retries=1)
+    else:
+        provider = PROVIDERS[args.provider]()
+
+    game_loop = Loop(
+        walkthrough_path=args.walkthrough_path,
+        output_file_path=args.output_path,
+        verbose=args.verbose,
+        output_mode=args.display,
+        walkthrough_workers=args.walkthrough_workers,
+        cache_path=args.cache_path,
+        cache_size=args.cache_size,
+        provider=provider,
+        max_turns=args.max_turns,
+        prioritization_window=args.prioritization_window,
+        rerank_every=args.rerank_every,
+        max_tasks=args.max_tasks,
+        completion_rules=args.completion_rules,
+        navigation=args.navigation,
+        seed=args.seed,
+        checkpoint_path=args.checkpoint_path,
+        checkpoint_every=args.checkpoint_every,
+        resume_path=args.resume_path,
+        limiter=limiter,
+        metrics_every=args.metrics_every,
+        profile=args.profile,
+        metrics_path=args.metrics_path,
+        memory_tokens=args.memory_tokens,
+        recall=args.recall,
+        stream=args.stream,
+        commands_per_turn=args.commands_per_turn,
+        validate_commands=args.validate_commands,
+        fused=args.fused,
+        stuck_window=args.stuck_window,
+        stuck_repeats=args.stuck_repeats,
+        speculate=args.speculate,
+    )
+    interrupted = False
     try:
-        game_loop = Loop(args.walkthrough_path, args.output_path, args.verbose)
         game_loop.loop()
-    except EOFError:
-        pass
-    except KeyboardInterrupt:
-        pass
+    except (EOFError, KeyboardInterrupt):
+        interrupted = True
     finally:
+        # don't make an interrupted run wait for the display to catch up
+        game_loop.close(drain=not interrupted)
         game_loop.dump_history()
@@ -0,0 +1,246 @@
+"""
+Play many independent games at once across a process pool
+
+Each game runs in its own worker process with its own game engine, history
+log and output log. LLM calls from every worker share one concurrency limit,
+the per-minute budgets are split evenly between the workers, and a summary
+line is written for each game as it finishes.
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List
+
+from adventuregpt.loop import Loop
+from adventuregpt.providers import PROVIDERS, resolve_api_key
+from adventuregpt.ratelimit import ConcurrencyLimiter, RateLimiter
+
+# job keys handled by the runner itself rather than passed on to Loop
+RUNNER_KEYS = {"name", "provider", "provider_options"}
+
+
+def read_jobs(path: str) -> Iterator[Dict]:
+    """
+    Read job definitions, one JSON object per line. Any key other than name,
+    provider and provider_options is passed to Loop as a keyword argument.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def llm_usage(metrics) -> Dict:
+    """
+    Total LLM calls, tokens and cost of a game, from the agents' metrics.
+    Cached responses are not counted as calls.
+    """
+    agents = [s for name, s in metrics.summary().items() if name.endswith("Agent")]
+    prompt_tokens = sum(s["prompt_tokens"] for s in agents)
+    completion_tokens = sum(s["completion_tokens"] for s in agents)
+    return {
+        "llm_calls": sum(s["calls"] - s["cache_hits"] for s in agents),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cost": sum(s["cost"] for s in agents),
+    }
+
+
+def run_game(job: Dict, out_dir: str, limiter=None) -> Dict:
+    """
+    Play one game to the end, or to its turn limit, in the current process
+
+    Args:
+        job (dict): the job definition
+        out_dir (str): directory the game's history and output logs are written to
+        limiter: shared limiter for the game's LLM calls
+
+    Returns:
+        dict: the game's summary
+    """
+    name = job["name"]
+    history_path = os.path.join(out_dir, f"{name}.jsonl")
+    log_path = os.path.join(out_dir, f"{name}.log")
+    loop_kwargs = {k: v for k, v in job.items() if k not in RUNNER_KEYS}
+    provider_name = job.get("provider", "openai")
+    provider_options = dict(job.get("provider_options", {}))
+    if provider_name == "openai" and isinstance(limiter, RateLimiter):
+        # the limiter does the retrying, with backoff shared by the whole game
+        provider_options.setdefault("max_retries", 1)
+    provider = PROVIDERS[provider_name](**provider_options)
+    summary = {"name": name, "history_path": history_path, "log_path": log_path, "error": None}
+
+    start = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        loop = Loop(output_file_path=history_path, output_mode="buffered", provider=provider,
+                    limiter=limiter, **loop_kwargs)
+        try:
+            loop.loop()
+        except Exception as e:
+            summary["error"] = repr(e)
+            traceback.print_exc(file=log)
+        finally:
+            loop.close()
+            loop.dump_history()
+
+    usage = llm_usage(loop.metrics)
+    score, max_score = loop.game.compute_score()
+    summary.update({
+        "seed": loop.seed,
+        "score": score,
+        "max_score": max_score,
+        "finished": bool(loop.game.is_finished),
+        "turns": loop.turns,
+        "commands": loop.game.turns,
+        **usage,
+        "wall_seconds": time.perf_counter() - start,
+    })
+    if isinstance(limiter, RateLimiter):
+        summary["rate_limiter"] = limiter.stats()
+    return summary
+
+
+def run_batch(jobs: List[Dict], out_dir: str, summary_path: str, workers: int = None,
+              max_concurrent_calls: int = None, requests_per_minute: float = None,
+              tokens_per_minute: float = None, max_retries: int = 6) -> List[Dict]:
+    """
+    Play every job across a pool of worker processes
+
+    Args:
+        jobs (List[dict]): job definitions, each needs a unique name
+        out_dir (str): directory for each game's history and output logs
+        summary_path (str): JSONL file a summary line is appended to as each game finishes
+        workers (int): number of games played at once, defaults to the number of cores
+        max_concurrent_calls (int): LLM calls allowed in flight across all games, unlimited if None
+        requests_per_minute (float): request budget across all games, unlimited if None
+        tokens_per_minute (float): token budget across all games, unlimited if None
+        max_retries (int): retries per LLM call before a game gives up
+
+    Returns:
+        List[dict]: the game summaries in the order the games finished
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if any(job.get("provider", "openai") == "openai" for job in jobs):
+        # ask for the key once here, workers inherit it through the environment
+        resolve_api_key()
+
+    workers = workers or os.cpu_count() or 1
+    share = min(workers, len(jobs)) or 1
+    summaries = []
+    with contextlib.ExitStack() as stack:
+        concurrency = None
+        if max_concurrent_calls:
+            manager = stack.enter_context(multiprocessing.Manager())
+            concurrency = ConcurrencyLimiter(manager.BoundedSemaphore(max_concurrent_calls))
+        # every game gets its own limiter, with its share of the per-minute budgets
+        limiter = RateLimiter(
+            requests_per_minute / share if requests_per_minute else None,
+            tokens_per_minute / share if tokens_per_minute else None,
+            max_retries=max_retries, concurrency=concurrency
+        )
+
+        pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+        summary_file = stack.enter_context(open(summary_path, 'w', encoding='utf-8'))
+        futures = {pool.submit(run_game, job, out_dir, limiter): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                # the worker itself died, e.g. the Loop couldn't be built
+                summary = {"name": futures[future]["name"], "error": repr(e)}
+            summaries.append(summary)
+            summary_file.write(json.dumps(summary) + "\n")
+            summary_file.flush()
+            print(format_summary(summary))
+
+    return summaries
+
+
+def format_summary(summary: Dict) -> str:
+    if summary.get("error") and "score" not in summary:
+        return f"{summary['name']}: failed with {summary['error']}"
+    line = (
+        f"{summary['name']}: score {summary['score']}/{summary['max_score']} after {summary['turns']} turns, "
+        f"{summary['total_tokens']} tokens, {summary['wall_seconds']:.1f}s"
+    )
+    if summary.get("error"):
+        line += f" (stopped by {summary['error']})"
+    return line
+
+
+def format_totals(summaries: List[Dict], wall: float) -> str:
+    played = [s for s in summaries if "score" in s]
+    scores = [s["score"] for s in played]
+    return "\n".join([
+        f"games:          {len(played)} played, {len(summaries) - len(played)} failed, "
+        f"{sum(1 for s in played if s['finished'])} finished",
+        f"mean score:     {sum(scores) / len(scores) if scores else 0.0:.1f}",
+        f"turns:          {sum(s['turns'] for s in played)}",
+        f"tokens:         {sum(s['total_tokens'] for s in played)}",
+        f"cost:           ${sum(s['cost'] for s in played):.4f}",
+        f"wall time:      {wall:.1f}s ({len(played) / wall * 3600 if wall else 0.0:.0f} games/hour)",
+    ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog="AdventureGPT batch",
+        description="Play many AdventureGPT games at once"
+    )
+    parser.add_argument("jobs_path", nargs="?",
+                        help="JSONL file of games to play; otherwise --games copies of one game are played")
+    parser.add_argument("-n", "--games", type=int, default=4,
+                        help="number of games to play when no jobs file is given")
+    parser.add_argument("-j", "--workers", type=int,
+                        help="number of games played at once, defaults to the number of cores")
+    parser.add_argument("-l", "--max_concurrent_calls", type=int,
+                        help="LLM calls allowed in flight across all games")
+    parser.add_argument("--requests_per_minute", type=float,
+                        help="request budget shared by all games")
+    parser.add_argument("--tokens_per_minute", type=float,
+                        help="token budget shared by all games")
+    parser.add_argument("--max_retries", type=int, default=6,
+                        help="retries per LLM call, with jittered exponential backoff")
+    parser.add_argument("-o", "--out_dir", default="runs",
+                        help="directory each game's history and output log are written to")
+    parser.add_argument("--summary", dest="summary_path",
+                        help="JSONL file of per-game results, defaults to summary.jsonl in the output directory")
+    parser.add_argument("-p", "--provider", choices=PROVIDERS.keys(), default="openai",
+                        help="model provider for games that don't name one")
+    parser.add_argument("-w", "--walkthrough_path")
+    parser.add_argument("-t", "--max_turns", type=int,
+                        help="turn limit for games that don't set one")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="seed of the first generated game, the rest count up from it")
+    args = parser.parse_args()
+
+    if args.jobs_path:
+        jobs = list(read_jobs(args.jobs_path))
+    else:
+        jobs = [{"name": f"game-{i:03d}", "seed": args.seed + i} for i in range(args.games)]
+
+    for i, job in enumerate(jobs):
+        job.setdefault("name", f"game-{i:03d}")
+        job.setdefault("provider", args.provider)
+        if args.walkthrough_path:
+            job.setdefault("walkthrough_path", args.walkthrough_path)
+        if args.max_turns is not None:
+            job.setdefault("max_turns", args.max_turns)
+
+    start = time.perf_counter()
+    summaries = run_batch(jobs, args.out_dir, args.summary_path or os.path.join(args.out_dir, "summary.jsonl"),
+                          args.workers, args.max_concurrent_calls, args.requests_per_minute,
+                          args.tokens_per_minute, args.max_retries)
+    print(format_totals(summaries, time.perf_counter() - start))
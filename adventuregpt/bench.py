@@ -0,0 +1,259 @@
+"""
+Deterministic, offline benchmark of the game loop
+
+Runs Loop.loop against the scripted FakeProvider and reports loop throughput
+so regressions can be measured without a live model service.
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from adventure import load_advent_dat
+from adventure.game import Game
+
+# the agents import LangChain lazily, do it up front so it isn't timed as play
+import adventuregpt.chain
+from adventuregpt.engine import game_template, new_game
+from adventuregpt.loop import Loop
+from adventuregpt.providers import PLAYER_SCRIPT, FakeProvider
+from adventuregpt.speculate import Speculator, restore, snapshot
+
+
+def run_benchmark(turns: int = 100, latency: float = 0.0, completion_tokens: int = None,
+                  walkthrough_path: str = None, history_path: str = None, **loop_kwargs) -> dict:
+    """
+    Play a scripted game and measure where the time goes
+
+    Args:
+        turns (int): number of player turns to play
+        latency (float): simulated seconds per LLM call
+        completion_tokens (int): fixed completion size per call, defaults to the response length
+        walkthrough_path (str): optional walkthrough to ingest first
+        history_path (str): optional history dump whose commands the player replays
+        loop_kwargs: any other Loop options to benchmark with
+
+    Returns:
+        dict: benchmark results
+    """
+    provider_kwargs = {"latency": latency, "completion_tokens": completion_tokens}
+    if history_path:
+        provider = FakeProvider.replay(history_path, **provider_kwargs)
+    else:
+        provider = FakeProvider(**provider_kwargs)
+
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as tmp:
+        loop = Loop(walkthrough_path, os.path.join(tmp, "history.jsonl"), output_mode="buffered",
+                    provider=provider, max_turns=turns, **loop_kwargs)
+
+        start = time.perf_counter()
+        loop.loop()
+        wall = time.perf_counter() - start
+        loop.close()
+        loop.dump_history()
+
+    # the loop times the game engine separately from everything else, and
+    # speculation, which plays commands on copies of the game, on its own
+    engine = {"commands": len(loop.metrics.samples["loop.engine"]),
+              "seconds": sum(loop.metrics.samples["loop.engine"])}
+    speculation_seconds = sum(loop.metrics.samples["loop.speculate"])
+    llm = provider.backend.stats()
+    played = loop.turns or 1
+    commands = engine["commands"] or 1
+    return {
+        "turns": loop.turns,
+        "commands": engine["commands"],
+        "wall_seconds": wall,
+        "turns_per_second": loop.turns / wall if wall else 0.0,
+        "llm_calls": llm["calls"],
+        "llm_calls_per_command": llm["calls"] / commands,
+        "prompt_tokens_per_turn": llm["prompt_tokens"] / played,
+        "completion_tokens_per_turn": llm["completion_tokens"] / played,
+        "rule_completion_checks": loop.completion_stats["rules"],
+        "llm_completion_checks": loop.completion_stats["llm"],
+        "navigation_routes": loop.navigation_stats["routes"],
+        "navigation_steps": loop.navigation_stats["steps"],
+        "commands_corrected": loop.validator.stats["corrected"] if loop.validator else 0,
+        "commands_dropped": loop.validator.stats["dropped"] if loop.validator else 0,
+        "stuck_loops": loop.loop_detector.stats["detected"] if loop.loop_detector else 0,
+        "speculated_candidates": loop.speculator.stats["candidates"] if loop.speculator else 0,
+        "engine_seconds": engine["seconds"],
+        "speculation_seconds": speculation_seconds,
+        "agent_seconds": wall - engine["seconds"] - speculation_seconds,
+    }
+
+
+# commands timed from a cold interpreter by the startup benchmark
+STARTUP_COMMANDS = {
+    "import adventuregpt.loop": ["-c", "import adventuregpt.loop"],
+    "cli --help": ["-m", "adventuregpt", "--help"],
+    "replay --help": ["-m", "adventuregpt.replay", "--help"],
+    "batch --help": ["-m", "adventuregpt.batch", "--help"],
+    "one fake turn": ["-m", "adventuregpt", "-p", "fake", "-t", "1", "-d", "instant", "-o", "{tmp}/history.jsonl"],
+}
+
+
+def run_startup_benchmark(repeats: int = 5) -> dict:
+    """
+    Time how long each entry point takes to start, each in a fresh Python
+    process, and how long a new game engine takes to build
+
+    Args:
+        repeats (int): runs of each command, the fastest is reported
+
+    Returns:
+        dict: seconds per command, and per game built
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, args in STARTUP_COMMANDS.items():
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, *[arg.format(tmp=tmp) for arg in args]], cwd=tmp,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                times.append(time.perf_counter() - start)
+            results[name] = min(times)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        game = Game()
+        load_advent_dat(game)
+    results["parse advent.dat"] = (time.perf_counter() - start) / repeats
+
+    game_template()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        new_game(start=False)
+    results["clone game template"] = (time.perf_counter() - start) / repeats
+    return results
+
+
+# candidate commands tried from the room the speculation benchmark stops in
+SPECULATION_CANDIDATES = [["west"], ["east"], ["take", "bird"], ["light", "lamp"], ["look"], ["inventory"]]
+
+
+def run_speculation_benchmark(forks: int = 200, opening: int = 15) -> dict:
+    """
+    Time what speculative command evaluation costs: freezing the game, forking
+    a copy of it, and playing and scoring candidate commands on the forks
+
+    Args:
+        forks (int): snapshots, forks and candidates to time
+        opening (int): moves of the scripted opening played first, so the
+            game has an inventory and a map to copy
+
+    Returns:
+        dict: milliseconds per snapshot, per fork and per candidate, and candidates per second
+    """
+    game = new_game(0)
+    for command in PLAYER_SCRIPT[:opening]:
+        game.do_command(command.split())
+    speculator = Speculator()
+    speculator.visit(game)
+
+    start = time.perf_counter()
+    for _ in range(forks):
+        frozen = snapshot(game)
+    snapshot_seconds = (time.perf_counter() - start) / forks
+
+    start = time.perf_counter()
+    for _ in range(forks):
+        restore(frozen)
+    fork_seconds = (time.perf_counter() - start) / forks
+
+    candidates = [SPECULATION_CANDIDATES[i % len(SPECULATION_CANDIDATES)] for i in range(forks)]
+    start = time.perf_counter()
+    for i in range(0, forks, len(SPECULATION_CANDIDATES)):
+        speculator.choose(game, candidates[i:i + len(SPECULATION_CANDIDATES)])
+    evaluate_seconds = time.perf_counter() - start
+
+    return {
+        "snapshot_bytes": len(frozen),
+        "snapshot_ms": snapshot_seconds * 1000,
+        "fork_ms": fork_seconds * 1000,
+        "candidate_ms": evaluate_seconds / forks * 1000,
+        "candidates_per_second": forks / evaluate_seconds if evaluate_seconds else 0.0,
+    }
+
+
+def format_speculation_report(results: dict) -> str:
+    return "\n".join([
+        f"snapshot size:           {results['snapshot_bytes']} bytes",
+        f"snapshot:                {results['snapshot_ms']:.3f} ms",
+        f"fork:                    {results['fork_ms']:.3f} ms",
+        f"candidate (fork+play):   {results['candidate_ms']:.3f} ms",
+        f"candidates/sec:          {results['candidates_per_second']:.0f}",
+    ])
+
+
+def format_startup_report(results: dict) -> str:
+    return "\n".join(f"{name + ':':<32}{seconds * 1000:>9.1f} ms" for name, seconds in results.items())
+
+
+def format_report(results: dict) -> str:
+    return "\n".join([
+        f"turns played:            {results['turns']}",
+        f"game commands:           {results['commands']}",
+        f"wall time:               {results['wall_seconds']:.3f}s",
+        f"turns/sec:               {results['turns_per_second']:.1f}",
+        f"LLM calls per command:   {results['llm_calls_per_command']:.2f}",
+        f"prompt tokens per turn:  {results['prompt_tokens_per_turn']:.1f}",
+        f"completion checks:       {results['rule_completion_checks']} by rule, "
+        f"{results['llm_completion_checks']} by LLM",
+        f"navigated locally:       {results['navigation_routes']} routes, {results['navigation_steps']} steps",
+        f"commands validated:      {results['commands_corrected']} corrected, "
+        f"{results['commands_dropped']} dropped",
+        f"stuck loops escaped:     {results['stuck_loops']}",
+        f"speculated candidates:   {results['speculated_candidates']}",
+        f"game engine time:        {results['engine_seconds']:.3f}s",
+        f"speculation time:        {results['speculation_seconds']:.3f}s",
+        f"agent time:              {results['agent_seconds']:.3f}s",
+    ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog="AdventureGPT benchmark",
+        description="Offline benchmark of the AdventureGPT loop"
+    )
+    parser.add_argument("-n", "--turns", type=int, default=100)
+    parser.add_argument("-l", "--latency", type=float, default=0.0,
+                        help="simulated seconds per LLM call")
+    parser.add_argument("--completion_tokens", type=int)
+    parser.add_argument("-w", "--walkthrough_path")
+    parser.add_argument("-r", "--replay", help="history dump whose player commands are replayed")
+    parser.add_argument("--fused", action="store_true", help="play with one TurnAgent call per turn")
+    parser.add_argument("--speculate", type=int, default=0,
+                        help="play with this many candidate commands tried on forks of the game per turn")
+    parser.add_argument("--speculation", action="store_true",
+                        help="time game snapshots, forks and candidate evaluation instead of playing")
+    parser.add_argument("--startup", action="store_true",
+                        help="time entry point startup from a cold interpreter instead of playing")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.startup:
+        results = run_startup_benchmark()
+        print(format_startup_report(results))
+    elif args.speculation:
+        results = run_speculation_benchmark(args.turns)
+        print(format_speculation_report(results))
+    else:
+        results = run_benchmark(args.turns, args.latency, args.completion_tokens, args.walkthrough_path,
+                                args.replay, fused=args.fused, speculate=args.speculate)
+        print(format_report(results))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
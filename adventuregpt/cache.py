@@ -0,0 +1,115 @@
+"""
+Persistent cache of LLM responses shared by all agents
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import hashlib
+import sqlite3
+import threading
+from typing import Optional
+
+
+class ResponseCache:
+    """
+    An on-disk, size-bounded LRU cache of LLM responses. Every agent runs at
+    temperature 0, so a rendered prompt always maps to the same response and
+    can be replayed from disk instead of calling the model again.
+    """
+
+    def __init__(self, path: str = "adventuregpt_cache.sqlite3", max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    agent TEXT,
+                    temperature REAL,
+                    response TEXT,
+                    last_used INTEGER
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+        self.size, clock = self.conn.execute("SELECT COUNT(*), MAX(last_used) FROM responses").fetchone()
+        self.clock = clock or 0
+
+    @staticmethod
+    def make_key(model: str, agent: str, temperature: float, prompt: str) -> str:
+        """
+        Build the content address for a rendered prompt
+        """
+        digest = hashlib.sha256()
+        for part in (model, agent, repr(float(temperature)), prompt):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _tick(self) -> int:
+        self.clock += 1
+        return self.clock
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        Return the cached response for the key, or None on a miss
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            with self.conn:
+                self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (self._tick(), key))
+            return row[0]
+
+    def update(self, key: str, response: str, model: str = "", agent: str = "", temperature: float = 0.0):
+        """
+        Store a response, evicting the least recently used entries past max_entries
+        """
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "UPDATE responses SET response = ?, last_used = ? WHERE key = ?",
+                (response, self._tick(), key)
+            )
+            if cur.rowcount == 0:
+                self.conn.execute(
+                    "INSERT INTO responses (key, model, agent, temperature, response, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, agent, temperature, response, self._tick())
+                )
+                self.size += 1
+
+            overflow = self.size - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+                self.size -= overflow
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": self.size}
+
+    def close(self):
+        self.conn.close()
+
+    def __str__(self):
+        return f"cache hits: {self.hits}, misses: {self.misses}, entries: {self.size}/{self.max_entries}"
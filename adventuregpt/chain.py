@@ -29,13 +29,17 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import os
+import asyncio
+import json
 import re
+import time
+from contextlib import contextmanager
 
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.callbacks.openai_info import OpenAICallbackHandler
 from langchain.chains import ConversationChain, LLMChain
-from langchain.chat_models import ChatOpenAI
-from langchain.llms import OpenAI
-from langchain.memory import ConversationBufferWindowMemory
+from langchain.chains.base import Chain
+from langchain.memory.chat_memory import BaseChatMemory
 from langchain.prompts import PromptTemplate
 from langchain.prompts.chat import (
     ChatPromptTemplate,
@@ -46,18 +50,14 @@ from langchain.prompts.chat import (
 )
 from langchain.schema import BaseMessage
 from pydantic import root_validator
-from typing import Dict, List
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
+from adventuregpt.cache import ResponseCache
 from adventuregpt.collections import SingleTaskListStorage
-
-OPENAI_TEMPERATURE = 0.0
-
-
-api_key = os.environ.get("OPENAI_API_KEY")
-
-if not api_key:
-    api_key = input("OpenAI Key:")
-    os.environ["OPENAI_API_KEY"] = api_key
+from adventuregpt.memory import BudgetedSummaryMemory, format_history_message
+from adventuregpt.metrics import Metrics
+from adventuregpt.providers import OPENAI_TEMPERATURE, OpenAIProvider
+from adventuregpt.ratelimit import NoLimit, estimate_tokens
 
 def openai_task_response_to_list(response: str):
     """
@@ -81,36 +81,274 @@ def openai_task_response_to_list(response: str):
     return [{"task_name": task_name} for task_name in new_tasks_list]
 
 
+# section headings of the TurnAgent's reply, and the field each one fills in
+TURN_SECTIONS = {
+    "complete": "complete",
+    "objective complete": "complete",
+    "status": "complete",
+    "new tasks": "new_tasks",
+    "tasks": "new_tasks",
+    "command": "command",
+    "commands": "command",
+    "next command": "command",
+}
+TURN_HEADING = re.compile(r'^[#*\s]*(' + "|".join(sorted(TURN_SECTIONS, key=len, reverse=True)) + r')[*\s]*:[*\s]*(.*)$',
+                          re.IGNORECASE)
+LIST_ITEM = re.compile(r'^\s*(?:\d+\s*[.)]|[-*\u2022])\s*(.+)$')
+
+
+def parse_verdict(text: str) -> Optional[bool]:
+    """
+    Read a completion verdict such as "yes", "COMPLETE" or "false"
+    """
+    words = re.findall(r'[a-z]+', text.lower())
+    if not words:
+        return None
+    if words[0] in ("yes", "true", "complete", "completed", "done"):
+        return True
+    if words[0] in ("no", "false", "incomplete", "not"):
+        return False
+    return None
+
+
+def parse_task_items(lines: List[str]) -> List[Dict[str, str]]:
+    """
+    Tasks from numbered or bulleted list lines, in the format
+    openai_task_response_to_list returns
+    """
+    tasks = []
+    for line in lines:
+        match = LIST_ITEM.match(line)
+        if match:
+            task_name = re.sub(r'[^\w\s_]+', '', match.group(1)).strip()
+            if task_name and task_name.lower() != "none":
+                tasks.append({"task_name": task_name})
+    return tasks
+
+
+def parse_turn_response(response: str) -> Dict:
+    """
+    Parse the TurnAgent's reply, in the format:
+
+    COMPLETE: yes
+    NEW TASKS:
+    1. task1
+    COMMAND: north
+
+    Headings may be in any case, order or markdown, and a JSON object with the
+    same fields is accepted too. A reply with no headings at all is taken to
+    be just the command, the way the PlayerAgent answers.
+
+    Returns:
+        Dict: "complete" (True, False or None when there was no verdict),
+        "new_tasks" (list of task dicts) and "command" (str)
+    """
+    text = re.sub(r'```\w*', '', response).strip()
+    turn = {"complete": None, "new_tasks": [], "command": ""}
+
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            fields = json.loads(text[start:end + 1])
+        except ValueError:
+            fields = None
+        if isinstance(fields, dict):
+            fields = {k.lower().replace("_", " "): v for k, v in fields.items()}
+            complete = fields.get("complete", fields.get("objective complete"))
+            if isinstance(complete, bool):
+                turn["complete"] = complete
+            elif complete is not None:
+                turn["complete"] = parse_verdict(str(complete))
+            tasks = fields.get("new tasks") or fields.get("tasks") or []
+            if isinstance(tasks, str):
+                tasks = tasks.split("\n")
+            turn["new_tasks"] = [
+                {"task_name": name} for name in
+                (re.sub(r'[^\w\s_]+', '', str(t)).strip() for t in tasks) if name
+            ]
+            command = fields.get("command") or fields.get("next command") or fields.get("commands") or ""
+            turn["command"] = "\n".join(command) if isinstance(command, list) else str(command)
+            return turn
+
+    sections = {"complete": [], "new_tasks": [], "command": []}
+    section = None
+    for line in text.split("\n"):
+        match = TURN_HEADING.match(line)
+        if match:
+            section = TURN_SECTIONS[match.group(1).lower()]
+            line = match.group(2)
+        if section is not None and line.strip():
+            sections[section].append(line.strip())
+
+    if section is None:
+        turn["command"] = text
+        return turn
+
+    turn["complete"] = parse_verdict(" ".join(sections["complete"]))
+    turn["new_tasks"] = parse_task_items(sections["new_tasks"])
+    # list markers and quotes around commands are not part of the command
+    commands = []
+    for line in sections["command"]:
+        item = LIST_ITEM.match(line)
+        commands.append((item.group(1) if item else line).strip('`"\' '))
+    turn["command"] = "\n".join(commands)
+    return turn
+
+
 def langchain_history_to_prompt(history: List[BaseMessage]) -> str:
     """
     Given a set of historical messages from a LangChain memory class, return a nicely
     formatted string for inclusion in a prompt, attempts to match what LangChain does for
     ConversationChains w/ memory
     """
-    prompt = ""
-    for msg in history:
-        # remove trailing whitespace
-        cleaned_content = msg.content
-        while cleaned_content[-1] == '\n':
-            cleaned_content = cleaned_content[:-1]
+    return "".join(format_history_message(msg) for msg in history)
+
+
+def render_history(history: BaseChatMemory) -> str:
+    """
+    Format a memory's history for a text prompt, reusing the memory's own
+    incrementally rendered copy when it keeps one
+    """
+    if isinstance(history, BudgetedSummaryMemory):
+        return history.render()
+    return langchain_history_to_prompt(history.load_memory_variables({})['history'])
+
+class PendingCall:
+    """
+    A model call about to go through the limiter. attempt makes one try,
+    counting it and collecting its token usage.
+    """
+
+    def __init__(self, predict, inputs: Dict, tokens: int):
+        self.predict = predict
+        self.inputs = inputs
+        self.tokens = tokens
+        self.usage = OpenAICallbackHandler()
+        self.attempts = 0
+        self.response: Optional[str] = None
+
+    def attempt(self):
+        self.attempts += 1
+        return self.predict(callbacks=[self.usage], **self.inputs)
+
+
+class Agent:
+    """
+    Base class for agents. Runs an agent's chain through the shared response
+    cache when one is configured, and through the limiter when the model has
+    to be called. Every call is timed, with its tokens, cost and retries, under
+    the agent's name.
+    """
 
-        if msg.type == "ai":
-            prompt += f"{msg.type.upper()}: {cleaned_content}\n"
-        else:
-            prompt += f"{msg.type.capitalize()}: {cleaned_content}\n"
+    def __init__(self, cache: Optional[ResponseCache] = None, provider=None, limiter=None,
+                 metrics: Optional[Metrics] = None):
+        self.cache = cache
+        self.provider = provider or OpenAIProvider()
+        self.limiter = limiter or NoLimit()
+        self.metrics = metrics or Metrics()
 
-        if msg.type == "human":
-            prompt += "\n\n"
+    def _render(self, chain: Chain, inputs: Dict) -> Tuple[str, Dict]:
+        """
+        Render the chain's prompt, including any memory
+        """
+        prepped = chain.prep_inputs(inputs)
+        prompt = chain.prompt.format_prompt(**{k: prepped[k] for k in chain.prompt.input_variables})
+        return prompt.to_string(), prepped
 
-    return prompt
+    def _cache_key(self, chain: Chain, prompt: str, agent: Optional[str] = None) -> str:
+        """
+        Cache key of a prompt. agent defaults to the agent's class name, and
+        distinguishes responses to the same prompt that were made differently.
+        """
+        return ResponseCache.make_key(
+            getattr(chain.llm, "model_name", ""),
+            agent or type(self).__name__,
+            getattr(chain.llm, "temperature", OPENAI_TEMPERATURE),
+            prompt
+        )
+
+    def _cache_update(self, chain: Chain, key: str, response: str, agent: Optional[str] = None):
+        self.cache.update(
+            key, response,
+            model=getattr(chain.llm, "model_name", ""),
+            agent=agent or type(self).__name__,
+            temperature=getattr(chain.llm, "temperature", OPENAI_TEMPERATURE)
+        )
+
+    def _cache_hit(self, chain: Chain, prepped: Dict, response: str) -> str:
+        # let the chain save the exchange to its memory as if it had been called
+        chain.prep_outputs(prepped, {chain.output_key: response})
+        return response
+
+    @staticmethod
+    def _completion_tokens(chain: Chain) -> int:
+        max_tokens = getattr(chain.llm, "max_tokens", None)
+        return max_tokens if isinstance(max_tokens, int) and max_tokens > 0 else 256
+
+    @staticmethod
+    def _count_usage(counts: Dict, usage: OpenAICallbackHandler, attempts: int):
+        counts.update(
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cost=usage.total_cost,
+            retries=max(attempts - 1, 0),
+        )
+
+    @contextmanager
+    def _calling(self, chain: Chain, inputs: Dict, predict) -> Iterator[PendingCall]:
+        """
+        Everything _predict and _apredict share: the call is timed, a cached
+        response is replayed when there is one, and a fresh response has its
+        usage counted and is cached. The caller only has to run call.attempt
+        through the limiter when call.response is still None.
+        """
+        with self.metrics.timer(type(self).__name__) as counts:
+            prompt, prepped = self._render(chain, inputs)
+            key = self._cache_key(chain, prompt) if self.cache is not None else None
+            cached = self.cache.lookup(key) if key is not None else None
+            call = PendingCall(predict, inputs, estimate_tokens(prompt, self._completion_tokens(chain)))
+            if cached is not None:
+                counts["cache_hits"] = 1
+                call.response = self._cache_hit(chain, prepped, cached)
+                yield call
+                return
+
+            try:
+                yield call
+            finally:
+                self._count_usage(counts, call.usage, call.attempts)
+            if key is not None:
+                self._cache_update(chain, key, call.response)
+
+    def _predict(self, chain: Chain, **inputs) -> str:
+        """
+        Run the chain through the limiter, replaying a cached response when there is one
+        """
+        with self._calling(chain, inputs, chain.predict) as call:
+            if call.response is None:
+                call.response = self.limiter.run(call.attempt, call.tokens)
+        return call.response
 
-class WalkthroughGameTaskCreationAgent:
+    async def _apredict(self, chain: Chain, **inputs) -> str:
+        """
+        Async version of _predict
+        """
+        with self._calling(chain, inputs, chain.apredict) as call:
+            if call.response is None:
+                call.response = await self.limiter.arun(call.attempt, call.tokens)
+        return call.response
+
+
+class WalkthroughGameTaskCreationAgent(Agent):
     """
     Agent that creates a list of game tasks to complete based on a given walthrough.
+    Bump adventuregpt.plan.PROMPT_VERSION when changing its prompt.
     """
 
-    def __init__(self, verbose: bool = False):
-        self.llm = OpenAI(temperature=OPENAI_TEMPERATURE)
+    def __init__(self, verbose: bool = False, cache: Optional[ResponseCache] = None, provider=None, limiter=None,
+                 metrics: Optional[Metrics] = None):
+        super().__init__(cache, provider, limiter, metrics)
+        self.llm = self.provider.llm(type(self).__name__)
         self.prompt = PromptTemplate(
                 input_variables=["walkthrough"],
                 template="""
@@ -142,18 +380,28 @@ Unless your list is empty, do not include any headers before your numbered list
             SingleTaskListStorage: A list of tasks to be completed to beat the game
 
         """
-        response = self.chain.run(walkthrough=walkthrough)
-        task_list = openai_task_response_to_list(response)
-        return SingleTaskListStorage(task_list)
+        return self._tasks(self._predict(self.chain, walkthrough=walkthrough))
+
+    async def arun(self, walkthrough: str) -> SingleTaskListStorage:
+        """
+        Async version of run
+        """
+        return self._tasks(await self._apredict(self.chain, walkthrough=walkthrough))
+
+    @staticmethod
+    def _tasks(response: str) -> SingleTaskListStorage:
+        return SingleTaskListStorage(openai_task_response_to_list(response), unique=False)
 
 
-class PrioritizationAgent:
+class PrioritizationAgent(Agent):
     """
     Agent that given a SingleTaskListStorage prioritizes the task list to be more effective
     """
 
-    def __init__(self, verbose: bool = False):
-        self.llm = OpenAI(temperature=OPENAI_TEMPERATURE)
+    def __init__(self, verbose: bool = False, cache: Optional[ResponseCache] = None, provider=None, limiter=None,
+                 metrics: Optional[Metrics] = None):
+        super().__init__(cache, provider, limiter, metrics)
+        self.llm = self.provider.llm(type(self).__name__)
         self.prompt = PromptTemplate(
                 input_variables=["tasks"],
                 template="""
@@ -186,15 +434,85 @@ These are the tasks : {tasks}
             SingleTaskListStorage: A list of tasks to be completed to beat the game
 
         """
-        task_names = task_storage.get_task_names()
+        return self._reorder(task_storage, self._predict(self.chain, **self._inputs(task_storage)))
+
+    async def arun(self, task_storage: SingleTaskListStorage) -> SingleTaskListStorage:
+        """
+        Async version of run
+        """
+        return self._reorder(task_storage, await self._apredict(self.chain, **self._inputs(task_storage)))
+
+    @staticmethod
+    def _inputs(task_storage: SingleTaskListStorage) -> Dict:
         bullet_string = '\n'
-        response = self.chain.run(tasks=bullet_string + bullet_string.join(task_names))
+        return {"tasks": bullet_string + bullet_string.join(task_storage.get_task_names())}
+
+    @staticmethod
+    def _reorder(task_storage: SingleTaskListStorage, response: str) -> SingleTaskListStorage:
         if not response:
             # Received empty response from priotritization agent. Keeping task list unchanged.
             return task_storage
 
         new_tasks = openai_task_response_to_list(response)
-        return SingleTaskListStorage(new_tasks)
+        return task_storage.copy(new_tasks)
+
+    async def arun_incremental(self, task_storage: SingleTaskListStorage, new_tasks: SingleTaskListStorage,
+                               window: int = 10) -> SingleTaskListStorage:
+        """
+        Insert new tasks into an already prioritized task list. Only the head of the
+        list, up to window tasks including the new ones, is sent to the model; the
+        rest of the list keeps its existing order behind it. At most half the window
+        goes to new tasks, so they are always ranked against the current top tasks;
+        any more are added to the end of the list.
+
+        Args:
+            task_storage (SingleTaskListStorage): The current, already prioritized task list
+            new_tasks (SingleTaskListStorage): Tasks to insert
+            window (int): Maximum number of tasks to send for ranking
+
+        Returns:
+            SingleTaskListStorage: The updated task list
+
+        """
+        # only tasks the list accepts count as new, duplicates are dropped here
+        incoming = [t for t in new_tasks if t.key not in task_storage.index and t.key not in task_storage.completed]
+        slots = max(window // 2, 1)
+        incoming, overflow = incoming[:slots], incoming[slots:]
+        tasks = task_storage.tasks
+        head_size = max(window - len(incoming), 0)
+        head, tail = tasks[:head_size], tasks[head_size:]
+
+        if not incoming:
+            return task_storage
+
+        ranked = await self.arun(task_storage.copy(head + incoming))
+        return task_storage.copy(ranked.tasks + tail + overflow)
+
+
+class TokenQueue(AsyncCallbackHandler):
+    """
+    Puts streamed tokens on a queue as they arrive
+    """
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.tokens = 0
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.tokens += 1
+        self.queue.put_nowait(token)
+
+
+def take_commands(text: str) -> Tuple[List[str], str]:
+    """
+    Split the complete command lines off streamed text. Lines end at a newline
+    or period, the way split_commands splits a full response.
+
+    Returns:
+        Tuple[List[str], str]: the lines that contain a command, and the incomplete rest of the text
+    """
+    *lines, rest = re.split(r'[\n.]', text)
+    return [line for line in lines if re.search(r'\w', line)], rest
 
 
 class CustomConversationChain(ConversationChain):
@@ -210,14 +528,16 @@ class CustomConversationChain(ConversationChain):
         return values
 
 
-class PlayerAgent:
+class PlayerAgent(Agent):
     """
     Agent that executes a task based on the given objective and previous game history
     """
 
-    def __init__(self, verbose: bool = False):
-        self.llm = ChatOpenAI(temperature=OPENAI_TEMPERATURE)
-        self.memory = ConversationBufferWindowMemory(return_messages=True, input_key="input", k=15)
+    def __init__(self, verbose: bool = False, cache: Optional[ResponseCache] = None, provider=None, limiter=None,
+                 metrics: Optional[Metrics] = None, memory_tokens: int = 600):
+        super().__init__(cache, provider, limiter, metrics)
+        self.llm = self.provider.chat_model(type(self).__name__)
+        self.memory = BudgetedSummaryMemory(return_messages=True, input_key="input", max_tokens=memory_tokens)
         self.prompt = ChatPromptTemplate.from_messages([
             SystemMessagePromptTemplate.from_template("""
 You are playing the 1977 classic Colossal Cave. 
@@ -232,14 +552,38 @@ The following objectives have been completed:
 
 {completed_tasks}
 
+{recalled}{candidates}
 """),
             MessagesPlaceholder(variable_name="history"),
             HumanMessagePromptTemplate.from_template("{input}")
         ])
         self.conversation = CustomConversationChain(memory=self.memory, prompt=self.prompt, llm=self.llm, verbose=verbose)
-
-
-    def run(self, objective: str, message: str, completed_tasks: SingleTaskListStorage) -> SingleTaskListStorage:
+        # pydantic validation hands the chain a copy of the memory, share that one
+        self.memory = self.conversation.memory
+        self.streaming_llm = None
+
+
+    @staticmethod
+    def _recalled(recalled: str) -> str:
+        return f"Earlier in the game you saw:\n{recalled}\n" if recalled else ""
+
+    @staticmethod
+    def _candidates(candidates: int) -> str:
+        if candidates < 2:
+            return ""
+        return (f"Instead of a single command, enter {candidates} different commands you could try next, "
+                "one per line, best first.\n")
+
+    def _inputs(self, objective: str, message: str, completed_tasks: SingleTaskListStorage,
+                recalled: str, candidates: int) -> Dict:
+        return {
+            "input": message, "objective": objective,
+            "completed_tasks": completed_tasks.get_task_names(), "recalled": self._recalled(recalled),
+            "candidates": self._candidates(candidates),
+        }
+
+    def run(self, objective: str, message: str, completed_tasks: SingleTaskListStorage,
+            recalled: str = "", candidates: int = 1) -> str:
         """
         Creates a list of game tasks to complete based game history
         
@@ -247,23 +591,133 @@ The following objectives have been completed:
             objective (str): next game taks
             message (str): next game output
             completed_tasks (SingleTaskListStorage): list of completed tasks
+            recalled (str): past game outputs relevant to the objective
+            candidates (int): number of alternative commands to ask for
 
         Returns:
             str: the next game input
 
         """
-        task_names = completed_tasks.get_task_names()
-        bullet_string = '\n'
-        return self.conversation.predict(input=message, objective=objective, completed_tasks=task_names)
+        inputs = self._inputs(objective, message, completed_tasks, recalled, candidates)
+        return self._predict(self.conversation, **inputs)
+
+    async def arun(self, objective: str, message: str, completed_tasks: SingleTaskListStorage,
+                   recalled: str = "", candidates: int = 1) -> str:
+        """
+        Async version of run
+        """
+        inputs = self._inputs(objective, message, completed_tasks, recalled, candidates)
+        return await self._apredict(self.conversation, **inputs)
+
+    async def astream(self, objective: str, message: str, completed_tasks: SingleTaskListStorage,
+                      recalled: str = "", max_commands: int = 1) -> AsyncIterator[str]:
+        """
+        Stream the player's response, yielding each command line as soon as it
+        is complete. Once max_commands have been seen the rest of the
+        generation is cancelled, so no tokens are spent on text that would be
+        thrown away. The memory and the cache keep the response as it was used.
+
+        Args:
+            objective (str): next game taks
+            message (str): next game output
+            completed_tasks (SingleTaskListStorage): list of completed tasks
+            recalled (str): past game outputs relevant to the objective
+            max_commands (int): commands to take before cancelling the generation
+
+        Yields:
+            str: command lines, in order
+        """
+        if self.streaming_llm is None:
+            self.streaming_llm = self.provider.chat_model(type(self).__name__, streaming=True)
+
+        inputs = self._inputs(objective, message, completed_tasks, recalled, candidates=1)
+        start = time.perf_counter()
+        prompt, prepped = self._render(self.conversation, inputs)
+        # the response is cut short after max_commands, so it mustn't be mistaken
+        # for a complete response to the same prompt
+        cache_agent = f"{type(self).__name__}.stream{max_commands}"
+        key = self._cache_key(self.conversation, prompt, cache_agent) if self.cache is not None else None
+        cached = self.cache.lookup(key) if key is not None else None
+        if cached is not None:
+            self.memory.save_context({"input": message}, {"response": cached})
+            self.metrics.record(type(self).__name__, time.perf_counter() - start, cache_hits=1)
+            lines, _ = take_commands(cached + "\n")
+            for line in lines[:max_commands]:
+                yield line
+            return
+
+        queue = asyncio.Queue()
+        streamed = TokenQueue(queue)
+        usage = OpenAICallbackHandler()
+        messages = self.prompt.format_prompt(**{k: prepped[k] for k in self.prompt.input_variables}).to_messages()
+
+        async def generate():
+            await self.streaming_llm.agenerate([messages], callbacks=[streamed, usage])
+
+        tokens = estimate_tokens(prompt, self._completion_tokens(self.conversation))
+        generation = asyncio.ensure_future(self.limiter.arun(generate, tokens))
+        # wake the reader up when the generation ends, however it ends
+        generation.add_done_callback(lambda _: queue.put_nowait(None))
+
+        used, pending, commands = [], "", 0
+        finished = False
+        first_command = generated_in = None
+        try:
+            while commands < max_commands and not finished:
+                token = await queue.get()
+                if token is None:
+                    generation.result()
+                    # the last line doesn't need a newline or period to be complete
+                    finished = True
+                    pending += "\n"
+                else:
+                    pending += token
+                lines, pending = take_commands(pending)
+
+                batch = lines[:max_commands - commands]
+                commands += len(batch)
+                used.extend(batch)
+                if commands == max_commands:
+                    # the stop policy: nothing generated after this command would be used
+                    generation.cancel()
+                if commands == max_commands or finished:
+                    # remember the response before the loop acts on its last command
+                    generated_in = time.perf_counter() - start
+                    self._remember(message, key, used, cache_agent)
+                for line in batch:
+                    if first_command is None:
+                        first_command = time.perf_counter() - start
+                        self.metrics.record(f"{type(self).__name__}.first_command", first_command)
+                    yield line
+        finally:
+            if not generation.done():
+                generation.cancel()
+            # time the generation only, not the loop acting on the commands
+            self.metrics.record(
+                type(self).__name__, generated_in or time.perf_counter() - start,
+                prompt_tokens=estimate_tokens(prompt, 0), completion_tokens=streamed.tokens,
+                cost=usage.total_cost,
+            )
+
+    def _remember(self, message: str, key: Optional[str], lines: List[str], cache_agent: str):
+        """
+        Save a streamed response to the memory and the cache, as far as it was used
+        """
+        response = "\n".join(line.strip() for line in lines)
+        self.memory.save_context({"input": message}, {"response": response})
+        if key is not None:
+            self._cache_update(self.conversation, key, response, cache_agent)
 
 
-class TaskCompletionAgent:
+class TaskCompletionAgent(Agent):
     """
     Agent that decides if the current objective has been completed
     """
 
-    def __init__(self, verbose: bool = False):
-        self.llm = OpenAI(temperature=OPENAI_TEMPERATURE)
+    def __init__(self, verbose: bool = False, cache: Optional[ResponseCache] = None, provider=None, limiter=None,
+                 metrics: Optional[Metrics] = None):
+        super().__init__(cache, provider, limiter, metrics)
+        self.llm = self.provider.llm(type(self).__name__)
         self.prompt = PromptTemplate(
                 input_variables=["objective", "history", "input"],
                 template="""
@@ -282,7 +736,7 @@ Human: {input}""")
         self.chain = LLMChain(prompt=self.prompt, llm=self.llm, verbose=verbose)
 
 
-    def run(self, objective: str, history: ConversationBufferWindowMemory, message: str,) -> SingleTaskListStorage:
+    def run(self, objective: str, history: BaseChatMemory, message: str) -> bool:
         """
         Creates a list of game tasks to complete based game history
         
@@ -294,17 +748,30 @@ Human: {input}""")
             bool: whether the task is complete or not
 
         """
-        formatted_history = langchain_history_to_prompt(history.load_memory_variables({})['history'])
-        return self.chain.run(objective=objective, history=formatted_history, input=message.strip()).lower() == "complete"
+        inputs = self._inputs(objective, history, message)
+        return self._predict(self.chain, **inputs).lower() == "complete"
+
+    async def arun(self, objective: str, history: BaseChatMemory, message: str) -> bool:
+        """
+        Async version of run
+        """
+        inputs = self._inputs(objective, history, message)
+        return (await self._apredict(self.chain, **inputs)).lower() == "complete"
+
+    @staticmethod
+    def _inputs(objective: str, history: BaseChatMemory, message: str) -> Dict:
+        return {"objective": objective, "history": render_history(history), "input": message.strip()}
 
 
-class GameTaskCreationAgent:
+class GameTaskCreationAgent(Agent):
     """
     Agent that creates a list of game tasks to complete based game history
     """
 
-    def __init__(self, verbose: bool = False):
-        self.llm = ChatOpenAI(temperature=OPENAI_TEMPERATURE)
+    def __init__(self, verbose: bool = False, cache: Optional[ResponseCache] = None, provider=None, limiter=None,
+                 metrics: Optional[Metrics] = None):
+        super().__init__(cache, provider, limiter, metrics)
+        self.llm = self.provider.chat_model(type(self).__name__)
         self.prompt = PromptTemplate(
             input_variables=["history", "input"],
             template="""
@@ -333,7 +800,7 @@ Human: {input}""")
         self.chain = LLMChain(prompt=self.prompt, llm=self.llm, verbose=verbose)
 
 
-    def run(self, history: ConversationBufferWindowMemory,  message: str) -> SingleTaskListStorage:
+    def run(self, history: BaseChatMemory,  message: str) -> SingleTaskListStorage:
         """
         Creates a list of game tasks to complete based game history
         
@@ -344,7 +811,102 @@ Human: {input}""")
             SingleTaskListStorage: A list of tasks to be completed to beat the game
 
         """
-        formatted_history = langchain_history_to_prompt(history.load_memory_variables({})['history'])
-        response = self.chain.run(history=formatted_history, input=message)
-        task_list = openai_task_response_to_list(response)
-        return SingleTaskListStorage(task_list)
+        response = self._predict(self.chain, history=render_history(history), input=message)
+        return SingleTaskListStorage(openai_task_response_to_list(response))
+
+    async def arun(self, history: BaseChatMemory, message: str) -> SingleTaskListStorage:
+        """
+        Async version of run
+        """
+        response = await self._apredict(self.chain, history=render_history(history), input=message)
+        return SingleTaskListStorage(openai_task_response_to_list(response))
+
+
+class TurnAgent(Agent):
+    """
+    Agent that plays a whole turn in one call: it decides whether the current
+    objective has been completed, suggests new tasks and chooses the next
+    command, all from the same history and game output. It stands in for the
+    TaskCompletionAgent, GameTaskCreationAgent, PrioritizationAgent and
+    PlayerAgent, and shares the PlayerAgent's memory so either mode can be
+    resumed from the same checkpoint.
+    """
+
+    def __init__(self, memory: BudgetedSummaryMemory, verbose: bool = False, cache: Optional[ResponseCache] = None,
+                 provider=None, limiter=None, metrics: Optional[Metrics] = None, upcoming_tasks: int = 5):
+        super().__init__(cache, provider, limiter, metrics)
+        self.llm = self.provider.chat_model(type(self).__name__)
+        self.memory = memory
+        self.upcoming_tasks = upcoming_tasks
+        self.prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template("""
+You are playing the 1977 classic Colossal Cave. 
+
+If you ask the same question in a loop, use the "help" command to get out of the loop. Don't get frustrated and only take one item at a time.
+
+The games text parser is limited, keep your commands to one action and 1-3 words. Look around and see what is visible. If your objective is invisible, keep moving. You can only move north, south, east, and west.
+
+Current objective: {objective}
+
+Upcoming tasks:
+{upcoming_tasks}
+
+The following objectives have been completed:
+
+{completed_tasks}
+
+{recalled}
+Reply in exactly this format, with no other output:
+
+COMPLETE: yes or no, whether the game output shows the current objective has been completed
+NEW TASKS:
+#. a new task the latest game output suggests, most important first, or "none"
+COMMAND: the next game input, for the first upcoming task if the objective is complete
+"""),
+            MessagesPlaceholder(variable_name="history"),
+            HumanMessagePromptTemplate.from_template("{input}")
+        ])
+        self.chain = LLMChain(prompt=self.prompt, llm=self.llm, verbose=verbose)
+
+    def _inputs(self, objective: str, message: str, completed_tasks: SingleTaskListStorage,
+                game_tasks: SingleTaskListStorage, recalled: str) -> Dict:
+        upcoming = game_tasks.get_task_names()[:self.upcoming_tasks]
+        return {
+            "input": message,
+            "history": self.memory.load_memory_variables({})["history"],
+            "objective": objective,
+            "upcoming_tasks": "\n".join(f"{i}. {name}" for i, name in enumerate(upcoming, 1)) or "none",
+            "completed_tasks": completed_tasks.get_task_names(),
+            "recalled": PlayerAgent._recalled(recalled),
+        }
+
+    def _remember(self, message: str, response: str) -> Dict:
+        turn = parse_turn_response(response)
+        self.memory.save_context({"input": message}, {"response": turn["command"]})
+        return turn
+
+    def run(self, objective: str, message: str, completed_tasks: SingleTaskListStorage,
+            game_tasks: SingleTaskListStorage, recalled: str = "") -> Dict:
+        """
+        Play a turn
+
+        Args:
+            objective (str): current game task
+            message (str): latest game output
+            completed_tasks (SingleTaskListStorage): list of completed tasks
+            game_tasks (SingleTaskListStorage): pending tasks, the first few are shown as upcoming
+            recalled (str): past game outputs relevant to the objective
+
+        Returns:
+            Dict: the parsed reply, see parse_turn_response
+        """
+        inputs = self._inputs(objective, message, completed_tasks, game_tasks, recalled)
+        return self._remember(message, self._predict(self.chain, **inputs))
+
+    async def arun(self, objective: str, message: str, completed_tasks: SingleTaskListStorage,
+                   game_tasks: SingleTaskListStorage, recalled: str = "") -> Dict:
+        """
+        Async version of run
+        """
+        inputs = self._inputs(objective, message, completed_tasks, game_tasks, recalled)
+        return self._remember(message, await self._apredict(self.chain, **inputs))
@@ -0,0 +1,58 @@
+"""
+Atomic checkpoints of the game loop state
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import os
+import pickle
+import secrets
+from typing import Dict, Tuple
+
+CHECKPOINT_VERSION = 1
+
+
+def make_temp_file(directory: str, prefix: str) -> Tuple[int, str]:
+    """
+    Create a new, uniquely named file to be moved into place later. Unlike
+    tempfile.mkstemp, which makes files readable by their owner only, the file
+    gets the same mode open() would give it under the umask.
+
+    Returns:
+        Tuple[int, str]: the open file descriptor and the file's path
+    """
+    while True:
+        path = os.path.join(directory, prefix + secrets.token_hex(8))
+        try:
+            return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666), path
+        except FileExistsError:
+            continue
+
+
+def save_checkpoint(path: str, state: Dict):
+    """
+    Pickle the loop state next to the checkpoint file and move it into place,
+    so a crash mid-write never leaves a truncated checkpoint behind
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = make_temp_file(directory, ".checkpoint-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({"version": CHECKPOINT_VERSION, **state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_checkpoint(path: str) -> Dict:
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {state.get('version')} in {path}")
+    return state
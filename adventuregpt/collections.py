@@ -29,47 +29,202 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-from collections import deque
-from typing import Dict, List
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+
+STOP_WORDS = {"a", "an", "the", "to"}
+
+# verb phrases reduced to one verb, so the particle doesn't read as a direction
+VERB_PHRASES = {"pick up": "take", "put down": "drop"}
+
+
+def normalize_task_name(task_name: str) -> str:
+    """
+    Reduce a task name to a key that near-identical tasks share, so that
+    "Take the lamp" and "take lamp." are recognised as the same task
+    """
+    text = " ".join(re.findall(r'\w+', task_name.lower()))
+    for phrase, verb in VERB_PHRASES.items():
+        text = re.sub(rf'\b{phrase}\b', verb, text)
+    return " ".join(w for w in text.split() if w not in STOP_WORDS)
+
+
+class Task:
+    """
+    A single game task
+    """
+
+    __slots__ = ("task_id", "task_name", "key")
+
+    def __init__(self, task_id: int, task_name: str):
+        self.task_id = task_id
+        self.task_name = task_name
+        self.key = normalize_task_name(task_name)
+
+    def __getitem__(self, field: str):
+        # tasks used to be plain dicts, keep task["task_name"] working
+        return getattr(self, field)
+
+    def __repr__(self):
+        return f"Task({self.task_id}, {self.task_name!r})"
+
+
+TaskLike = Union[Task, Dict, str]
 
 
 class SingleTaskListStorage:
     """
-    A task list for storing game tasks
+    An ordered task list for storing game tasks. Tasks are indexed by id and by
+    normalized name, so duplicates and already completed tasks are rejected in
+    O(1) and the list never grows past max_tasks.
     """
 
-    def __init__(self, initial_list: list = []):
-        self.tasks = deque(initial_list or [])
+    def __init__(self, initial_list: Optional[Iterable[TaskLike]] = None, max_tasks: Optional[int] = None,
+                 unique: bool = True):
+        self._tasks = OrderedDict()
+        self.index = {}
+        self.completed = set()
+        self.max_tasks = max_tasks
+        self.unique = unique
         self.task_id_counter = 0
+        self.extend(initial_list or [])
 
-    def append(self, task: Dict):
-        self.tasks.append(task)
+    @property
+    def tasks(self) -> List[Task]:
+        return list(self._tasks.values())
 
-    def replace(self, tasks: List[Dict]):
-        self.tasks = deque(tasks)
+    def append(self, task: TaskLike) -> Optional[Task]:
+        """
+        Add a task to the end of the list
 
-    def popleft(self):
-        return self.tasks.popleft()
+        Returns:
+            Task: the stored task, or None if it was a duplicate or already completed
+        """
+        task_name = self._task_name(task)
+        key = normalize_task_name(task_name)
+        if not key:
+            return None
+        if self.unique and (key in self.index or key in self.completed):
+            return None
+
+        return self._insert(Task(self.next_task_id(), task_name))
+
+    def _insert(self, record: Task) -> Task:
+        self._tasks[record.task_id] = record
+        self.index[record.key] = record.task_id
+
+        # drop the lowest priority tasks once the list is full
+        while self.max_tasks is not None and len(self._tasks) > self.max_tasks:
+            self.remove(next(reversed(self._tasks)))
+
+        return record
+
+    def extend(self, tasks: Iterable[TaskLike]):
+        for task in tasks:
+            self.append(task)
+
+    def replace(self, tasks: Iterable[TaskLike]):
+        """
+        Replace the contents of the list, keeping ids of tasks that were already present
+        """
+        existing = {t.key: t for t in self._tasks.values()}
+        self._tasks = OrderedDict()
+        self.index = {}
+        for task in tasks:
+            name = self._task_name(task)
+            record = existing.pop(normalize_task_name(name), None)
+            if record is not None:
+                self._insert(record)
+            else:
+                self.append(name)
+
+    def popleft(self) -> Optional[Task]:
+        if not self._tasks:
+            return None
+        _, task = self._tasks.popitem(last=False)
+        self._unindex(task)
+        return task
+
+    def get(self, task_id: int) -> Optional[Task]:
+        return self._tasks.get(task_id)
+
+    def find(self, task_name: str) -> Optional[Task]:
+        task_id = self.index.get(normalize_task_name(task_name))
+        return None if task_id is None else self._tasks[task_id]
+
+    def remove(self, task_id: int) -> Optional[Task]:
+        task = self._tasks.pop(task_id, None)
+        if task is not None:
+            self._unindex(task)
+        return task
+
+    def complete(self, task: TaskLike):
+        """
+        Mark a task as completed, removing it and rejecting it from now on
+        """
+        key = normalize_task_name(self._task_name(task))
+        self.completed.add(key)
+        task_id = self.index.get(key)
+        if self.unique and task_id is not None:
+            self.remove(task_id)
+
+    @staticmethod
+    def _task_name(task: TaskLike) -> str:
+        if isinstance(task, (Task, dict)):
+            return task["task_name"]
+        return task
+
+    def _unindex(self, task: Task):
+        if self.index.get(task.key) == task.task_id:
+            del self.index[task.key]
 
     def is_empty(self):
-        return False if self.tasks else True
+        return False if self._tasks else True
 
     def next_task_id(self):
         self.task_id_counter += 1
         return self.task_id_counter
 
     def get_task_names(self):
-        return [t["task_name"] for t in self.tasks]
+        return [t.task_name for t in self._tasks.values()]
+
+    def copy(self, tasks: Optional[Iterable[TaskLike]] = None) -> "SingleTaskListStorage":
+        """
+        Create a new list with the same settings and completed tasks, holding
+        either the same tasks or the given ones
+        """
+        new = type(self)(max_tasks=self.max_tasks, unique=self.unique)
+        new.completed = set(self.completed)
+        new.task_id_counter = self.task_id_counter
+        new._tasks = OrderedDict(self._tasks)
+        new.index = dict(self.index)
+        if tasks is not None:
+            new.replace(tasks)
+        return new
+
+    def __contains__(self, task_name: str):
+        return normalize_task_name(task_name) in self.index
+
+    def __iter__(self) -> Iterator[Task]:
+        return iter(self._tasks.values())
+
+    def __len__(self):
+        return len(self._tasks)
 
     def __repr__(self):
-        return self.tasks
+        return f"SingleTaskListStorage({self.tasks!r})"
 
     def __str__(self):
-        return "\n".join([f'{i}. {t["task_name"]}' for i, t in enumerate(self.tasks)])
-    
+        return "\n".join([f'{i}. {t.task_name}' for i, t in enumerate(self._tasks.values())])
+
     @classmethod
     def concat(cls, a, b):
         """
-        Concatenate the tasks from two lists together
+        Concatenate the tasks from two lists together, keeping the settings and
+        completed tasks of the first
         """
-        return cls(a.tasks + b.tasks)
\ No newline at end of file
+        new = a.copy()
+        new.extend(b)
+        return new
@@ -0,0 +1,184 @@
+"""
+Turn LLM output into commands the game engine understands
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import functools
+import operator
+import re
+from typing import Dict, List, Optional, Set
+
+from adventure.game import YESNO_ANSWERS
+
+# shown to the player in place of game output when a response had no command
+NOT_A_COMMAND = "I don't understand that. Commands are one or two words, like NORTH or TAKE LAMP.\n"
+
+# phrases the engine doesn't know, rewritten to its own verbs
+REWRITES = {
+    "pick up": "take",
+    "grab": "take",
+    "put down": "drop",
+    "look around": "look",
+    "turn on": "light",
+    "switch on": "light",
+    "turn off": "off",
+    "switch off": "off",
+    "check inventory": "inventory",
+}
+
+# common prose words that happen to be one letter away from a game word,
+# e.g. "will" and "fill"
+PROSE_WORDS = {
+    "will", "then", "than", "that", "this", "with", "from", "into", "onto", "have", "here", "there",
+    "next", "some", "what", "when", "where", "which", "would", "should", "could", "lets", "also",
+}
+
+# word kind pairs the engine's parser acts on
+COMMAND_KINDS = {("verb", "noun"), ("noun", "verb")}
+
+
+def split_commands(text: str) -> List[str]:
+    """
+    Split LLM output into candidate command lines on newlines and periods
+    """
+    newline_split = text.lower().split('\n')
+    period_split = [line.split('.') for line in newline_split]
+    return functools.reduce(operator.iconcat, period_split, [])
+
+
+def deletions(word: str) -> Set[str]:
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+class CommandValidator:
+    """
+    Checks command lines against the game's vocabulary before they are sent to
+    Game.do_command, which spends a turn, and a roll of the game's dice, on
+    anything it doesn't understand.
+
+    Words are looked up in a dict of every vocabulary word and its five letter
+    truncation, the same forms the engine accepts. Unknown words are dropped,
+    small typos are corrected with a hashed index of single letter deletions,
+    and the remaining words are cut down to a command the parser will act on.
+    Lines with nothing the game knows are dropped entirely.
+
+    Args:
+        vocabulary (dict): a game's vocabulary, as loaded by load_advent_dat
+    """
+
+    def __init__(self, vocabulary: Dict):
+        self.words = {}
+        for key, word in vocabulary.items():
+            if isinstance(key, str) and key.isalpha():
+                self.words[key] = word
+                self.words.setdefault(key[:5], word)
+
+        # word with a letter missing -> the game words it could have come from
+        self.corrections: Dict[str, Set[str]] = {}
+        for key in self.words:
+            if len(key) >= 4:
+                for variant in deletions(key):
+                    self.corrections.setdefault(variant, set()).add(key)
+
+        self.stats = {"commands": 0, "corrected": 0, "dropped": 0}
+
+    @classmethod
+    def from_game(cls, game) -> "CommandValidator":
+        return cls(game.vocabulary)
+
+    def correct(self, word: str) -> Optional[str]:
+        """
+        The game word a typo was most likely meant to be: one letter missing,
+        one extra, or two letters swapped. Ambiguous typos are not corrected.
+        """
+        if len(word) < 4 or word in PROSE_WORDS:
+            return None
+        candidates = set(self.corrections.get(word, ()))
+        candidates.update(variant for variant in deletions(word) if variant in self.words)
+        for i in range(len(word) - 1):
+            swapped = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+            if swapped in self.words:
+                candidates.add(swapped)
+        return candidates.pop() if len(candidates) == 1 else None
+
+    def lookup(self, word: str) -> Optional[str]:
+        """
+        The form of a word to send to the engine, or None if it isn't a game word
+        """
+        if word in self.words:
+            return word
+        if word[:5] in self.words and len(word) > 5:
+            return word[:5]
+        return self.correct(word)
+
+    def normalize(self, line: str) -> List[str]:
+        text = " ".join(re.findall(r'\w+', line.lower()))
+        for phrase, replacement in REWRITES.items():
+            text = re.sub(rf'\b{phrase}\b', replacement, text)
+        return text.split()
+
+    def validate(self, line: str, yesno: bool = False) -> Optional[List[str]]:
+        """
+        Make a command the engine will understand out of one line of LLM output
+
+        Args:
+            line (str): one candidate command line
+            yesno (bool): whether the game is waiting on the answer to a question
+
+        Returns:
+            Optional[List[str]]: the words to send to Game.do_command, or None
+            if the line should be dropped
+        """
+        words = self.normalize(line)
+        if yesno:
+            answers = [word for word in words if word in YESNO_ANSWERS]
+            if answers:
+                return self._counted(words, answers[:1])
+
+        known = [self.lookup(word) for word in words]
+        known = [word for word in known if word is not None]
+        if not known:
+            self.stats["dropped"] += 1
+            return None
+        return self._counted(words, self.pick(known))
+
+    def _counted(self, words: List[str], command: List[str]) -> List[str]:
+        self.stats["commands"] += 1
+        if command != words:
+            self.stats["corrected"] += 1
+        return command
+
+    def pick(self, words: List[str]) -> List[str]:
+        """
+        Choose at most two words that make a command the parser acts on, out of
+        the game words found in a line
+        """
+        if len(words) == 1:
+            return words
+        first = self.words[words[0]]
+        second = self.words[words[1]]
+        if first.text in ("enter", "walk", "say") or (first.kind, second.kind) in COMMAND_KINDS:
+            return words[:2]
+        if first.text in ("water", "oil") and second.kind == "noun":
+            # "water plant" pours the water
+            return words[:2]
+
+        # prefer an action on an object, e.g. "take the lamp and the keys"
+        kinds = [self.words[word].kind for word in words]
+        if "verb" in kinds:
+            verb = kinds.index("verb")
+            if "noun" in kinds[verb:]:
+                return [words[verb], words[verb + kinds[verb:].index("noun")]]
+        for kind in ("travel", "verb", "noun"):
+            if kind in kinds:
+                return [words[kinds.index(kind)]]
+        return words[:1]
+
+    def __str__(self):
+        return (
+            f"Commands: {self.stats['commands']} sent, {self.stats['corrected']} corrected, "
+            f"{self.stats['dropped']} dropped"
+        )
@@ -0,0 +1,42 @@
+"""
+Fresh game engines from one parsed copy of advent.dat
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import functools
+import pickle
+from typing import Optional
+
+from adventure import load_advent_dat
+from adventure.game import Game
+
+
+@functools.lru_cache(maxsize=None)
+def game_template() -> bytes:
+    """
+    A game with advent.dat loaded but not yet started, parsed once per process
+    and kept pickled, so every copy made from it is independent
+    """
+    game = Game()
+    load_advent_dat(game)
+    return pickle.dumps(game)
+
+
+def new_game(seed: Optional[int] = None, start: bool = True) -> Game:
+    """
+    A game cloned from the template instead of parsing advent.dat again, in
+    the same state as Game(seed) with the data loaded
+
+    Args:
+        seed (int): the game's random seed, None for an unpredictable one
+        start (bool): whether to start the game, which asks about instructions
+    """
+    game = pickle.loads(game_template())
+    # reseeding, even with None, keeps clones from sharing the template's dice
+    game.random_generator.seed(seed)
+    if start:
+        game.start()
+    return game
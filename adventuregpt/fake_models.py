@@ -0,0 +1,132 @@
+"""
+Offline LangChain models answered by a scripted FakeBackend
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import asyncio
+import re
+import time
+from collections import defaultdict
+from typing import Any, List, Optional
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models.base import BaseChatModel
+from langchain.llms.base import BaseLLM
+from langchain.schema import (
+    AIMessage,
+    BaseMessage,
+    ChatGeneration,
+    ChatResult,
+    Generation,
+    LLMResult,
+    get_buffer_string,
+)
+
+from adventuregpt.providers import OPENAI_TEMPERATURE
+
+
+class FakeLLM(BaseLLM):
+    """
+    Completion model answered by a FakeBackend
+    """
+
+    backend: Any
+    agent: str
+    model_name: str = "fake"
+    temperature: float = OPENAI_TEMPERATURE
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        time.sleep(self.backend.latency)
+        generations = []
+        for prompt in prompts:
+            text, llm_output = self.backend.respond(self.agent, prompt)
+            generations.append([Generation(text=text)])
+        return LLMResult(generations=generations, llm_output=llm_output)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        await asyncio.sleep(self.backend.latency)
+        generations = []
+        for prompt in prompts:
+            text, llm_output = self.backend.respond(self.agent, prompt)
+            generations.append([Generation(text=text)])
+        return LLMResult(generations=generations, llm_output=llm_output)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answered by a FakeBackend
+    """
+
+    backend: Any
+    agent: str
+    model_name: str = "fake"
+    temperature: float = OPENAI_TEMPERATURE
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        text, llm_output = self.backend.respond(self.agent, get_buffer_string(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))], llm_output=llm_output)
+
+    def _combine_llm_outputs(self, llm_outputs: List[Optional[dict]]) -> dict:
+        # report token usage the way ChatOpenAI does, so usage callbacks see it
+        token_usage = defaultdict(int)
+        for output in llm_outputs:
+            for k, v in (output or {}).get("token_usage", {}).items():
+                token_usage[k] += v
+        return {"token_usage": dict(token_usage), "model_name": self.model_name}
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.backend.latency)
+        return self._respond(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if not self.streaming:
+            await asyncio.sleep(self.backend.latency)
+            return self._respond(messages)
+
+        # spread the latency over the tokens, like a real streamed completion
+        result = self._respond(messages)
+        chunks = re.findall(r'\S+\s*|\s+', result.generations[0].message.content) or [""]
+        for chunk in chunks:
+            await asyncio.sleep(self.backend.latency / len(chunks))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk)
+        return result
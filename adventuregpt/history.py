@@ -0,0 +1,97 @@
+"""
+Append-only, streaming log of the game history
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import ast
+import json
+from collections import deque
+from typing import Dict, Iterator, List
+
+
+class HistoryLog:
+    """
+    Writes history records to a JSONL file as the game is played. Records are
+    flushed in batches, so a crash loses at most the last batch, and only a short
+    tail of recent records is kept in memory.
+    """
+
+    def __init__(self, path: str, flush_every: int = 16, tail_size: int = 100, mode: str = 'w'):
+        self.path = path
+        self.flush_every = flush_every
+        self.tail = deque(maxlen=tail_size)
+        self.pending: List[str] = []
+        self.count = 0
+        self.file = open(path, mode, encoding='utf-8')
+
+    @classmethod
+    def resume(cls, path: str, offset: int, count: int, **kwargs) -> "HistoryLog":
+        """
+        Reopen a log for appending, dropping anything written after offset
+        """
+        with open(path, 'r+', encoding='utf-8') as f:
+            f.truncate(offset)
+
+        log = cls(path, mode='a', **kwargs)
+        log.count = count
+        return log
+
+    def offset(self) -> int:
+        """
+        Flush and return the position of the end of the log, for checkpoints
+        """
+        self.flush()
+        return self.file.tell()
+
+    def append(self, record: Dict):
+        """
+        Add a record to the log, numbering it with its position in the history
+        """
+        record = {"index": self.count, **record}
+        self.count += 1
+        self.tail.append(record)
+        self.pending.append(json.dumps(record))
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write("\n".join(self.pending) + "\n")
+            self.pending = []
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self) -> Iterator[Dict]:
+        """
+        Stream the whole history back from disk
+        """
+        self.flush()
+        return read_history(self.path)
+
+
+def read_history(path: str) -> Iterator[Dict]:
+    """
+    Lazily read history records from a JSONL log. Older history dumps, which were
+    a single pretty printed list, are read as well.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            yield from ast.literal_eval(f.read())
+            return
+
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -7,28 +7,27 @@ Copyright 2023 Lily Hughes-Robinson.
 Licensed as free software under the
 Apache License, Version 2.0 as detailed in the accompanying README.txt.
 """
+import asyncio
 import functools
-import operator
+import random
 import re
-import sys
-import pprint
-from time import sleep
-
-from adventure import load_advent_dat
-from adventure.game import Game
-from langchain.text_splitter import CharacterTextSplitter
-
-from adventuregpt.chain import (
-        GameTaskCreationAgent,
-        WalkthroughGameTaskCreationAgent,
-        PrioritizationAgent,
-        PlayerAgent,
-        TaskCompletionAgent
-    )
-from adventuregpt.collections import SingleTaskListStorage
-
 
-BAUD = 1200
+from adventuregpt.cache import ResponseCache
+from adventuregpt.checkpoint import load_checkpoint, save_checkpoint
+from adventuregpt.collections import SingleTaskListStorage
+from adventuregpt.commands import NOT_A_COMMAND, CommandValidator, split_commands
+from adventuregpt.engine import new_game
+from adventuregpt.history import HistoryLog
+from adventuregpt.metrics import Metrics
+from adventuregpt.navigation import Route, RoomGraph
+from adventuregpt.output import make_output
+from adventuregpt.plan import PLAN_SUFFIX, compile_plan, is_current, load_plan, plan_path_for, save_plan
+from adventuregpt.providers import OpenAIProvider
+from adventuregpt.ratelimit import RateLimiter
+from adventuregpt.retrieval import ObservationIndex
+from adventuregpt.rules import check_completion
+from adventuregpt.speculate import Speculator
+from adventuregpt.stuck import STUCK_NOTE, LoopDetector
 
 
 class Loop():
@@ -37,144 +36,641 @@ class Loop():
     game is won or an exception is thrown
     """
 
-    def __init__(self, walkthrough_path: str = "", output_file_path: str = "game_output.txt", verbose: bool = False):
-        self.history = []
-        self.game_tasks = SingleTaskListStorage()
+    def __init__(self, walkthrough_path: str = "", output_file_path: str = "game_output.jsonl", verbose: bool = False,
+                 output_mode: str = "baud", *, walkthrough_workers: int = 4, cache_path: str = None,
+                 cache_size: int = 10000, provider=None, max_turns: int = None, prioritization_window: int = 10,
+                 rerank_every: int = 10, max_tasks: int = 50, completion_rules: bool = True,
+                 navigation: bool = True, seed: int = None, checkpoint_path: str = None, checkpoint_every: int = 5,
+                 resume_path: str = None, limiter=None, metrics_every: int = 0, profile: bool = False,
+                 metrics_path: str = None, memory_tokens: int = 600, recall: int = 3, stream: bool = False,
+                 commands_per_turn: int = 1, validate_commands: bool = True, fused: bool = False,
+                 stuck_window: int = 12, stuck_repeats: int = 3, speculate: int = 0):
+        state = load_checkpoint(resume_path) if resume_path else None
+        if state:
+            # carry on writing the history log where the checkpoint left it
+            self.output_file_path = state["history_path"]
+            self.history = HistoryLog.resume(self.output_file_path, state["history_offset"], state["history_count"])
+        else:
+            self.output_file_path = output_file_path or "game_output.jsonl"
+            self.history = HistoryLog(self.output_file_path)
+        # walkthroughs legitimately repeat steps and need every one of them
+        self.game_tasks = SingleTaskListStorage(
+            max_tasks=None if walkthrough_path else max_tasks, unique=not walkthrough_path
+        )
         self.completed_tasks = SingleTaskListStorage()
         self.walkthrough_path = walkthrough_path
-        self.output_file_path = output_file_path
+        self.walkthrough_workers = walkthrough_workers
         self.current_task = None
         self.verbose = verbose
+        self.output = make_output(output_mode)
+        self.cache = ResponseCache(cache_path, cache_size) if cache_path else None
+        self.provider = provider or OpenAIProvider()
+        self.limiter = limiter
+        self.metrics = Metrics()
+        self.metrics_every = metrics_every
+        self.metrics_path = metrics_path
+        self.profile = profile
+        self.memory_tokens = memory_tokens
+        self.recall = recall
+        self.stream = stream
+        self.commands_per_turn = commands_per_turn
+        self.fused = fused
+        self.observations = ObservationIndex()
+        self.max_turns = max_turns
+        self.prioritization_window = prioritization_window
+        self.rerank_every = rerank_every
+        self.task_updates = 0
+        self.completion_rules = completion_rules
+        self.completion_stats = {"rules": 0, "llm": 0}
+        self.turns = 0
         
-        self.game = Game()
-        load_advent_dat(self.game)
-        self.game.start()
+        self.checkpoint_path = checkpoint_path or resume_path
+        self.checkpoint_every = checkpoint_every
+        self.resumed = state is not None
+        self.resumed_memory = {}
+
+        if state:
+            self.seed = state["seed"]
+            self.game = state["game"]
+        else:
+            # seed the game so that a recorded history can be replayed exactly
+            self.seed = random.randrange(2 ** 32) if seed is None else seed
+            self.game = new_game(self.seed)
+            self.record_history("meta", "", seed=self.seed)
         self.curr_game_output = self.game.output
 
+        self.room_graph = RoomGraph(self.game)
+        self.navigation = navigation
+        self.navigation_failed_task = None
+        self.navigation_stats = {"routes": 0, "steps": 0}
+        self.validator = CommandValidator.from_game(self.game) if validate_commands else None
+        self.loop_detector = LoopDetector(stuck_window, stuck_repeats) if stuck_window else None
+        self.stuck = False
+        self.speculator = Speculator() if speculate > 1 else None
+        self.speculate = speculate
+        if self.speculator:
+            self.speculator.visit(self.game)
+
+        if state:
+            self.restore_state(state)
+
+    # Agents are built the first time they are needed, so a run only imports
+    # LangChain and builds models for the agents it actually uses
+
+    @functools.cached_property
+    def player_agent(self):
+        from adventuregpt.chain import PlayerAgent
+        agent = PlayerAgent(self.verbose, self.cache, self.provider, self.limiter, self.metrics, self.memory_tokens)
+        if self.resumed_memory:
+            if isinstance(self.resumed_memory, list):
+                # checkpoints from before the memory was summarized only hold messages
+                self.resumed_memory = {"messages": self.resumed_memory}
+            agent.memory.restore(self.resumed_memory)
+        return agent
+
+    @functools.cached_property
+    def game_task_creation_agent(self):
+        from adventuregpt.chain import GameTaskCreationAgent
+        return GameTaskCreationAgent(self.verbose, self.cache, self.provider, self.limiter, self.metrics)
+
+    @functools.cached_property
+    def walkthrough_game_task_creation_agent(self):
+        from adventuregpt.chain import WalkthroughGameTaskCreationAgent
+        return WalkthroughGameTaskCreationAgent(self.verbose, self.cache, self.provider, self.limiter, self.metrics)
+
+    @functools.cached_property
+    def prioritization_agent(self):
+        from adventuregpt.chain import PrioritizationAgent
+        return PrioritizationAgent(self.verbose, self.cache, self.provider, self.limiter, self.metrics)
+
+    @functools.cached_property
+    def task_completion_agent(self):
+        from adventuregpt.chain import TaskCompletionAgent
+        return TaskCompletionAgent(self.verbose, self.cache, self.provider, self.limiter, self.metrics)
+
+    @functools.cached_property
+    def turn_agent(self):
+        from adventuregpt.chain import TurnAgent
+        return TurnAgent(self.player_agent.memory, self.verbose, self.cache, self.provider, self.limiter,
+                         self.metrics)
+
+    def checkpoint_state(self) -> dict:
+        """
+        Everything needed to pick the game back up where it is now
+        """
+        return {
+            "seed": self.seed,
+            "game": self.game,
+            "curr_game_output": self.curr_game_output,
+            "game_tasks": self.game_tasks,
+            "completed_tasks": self.completed_tasks,
+            "current_task": self.current_task,
+            "turns": self.turns,
+            "task_updates": self.task_updates,
+            "player_memory": self.player_agent.memory.state(),
+            "room_graph_observed": dict(self.room_graph.observed),
+            "navigation_failed_task": self.navigation_failed_task,
+            "completion_stats": self.completion_stats,
+            "navigation_stats": self.navigation_stats,
+            "observations": self.observations,
+            "loop_detector": self.loop_detector,
+            "speculator": self.speculator,
+            "history_path": self.output_file_path,
+            "history_offset": self.history.offset(),
+            "history_count": self.history.count,
+        }
+
+    def restore_state(self, state: dict):
+        """
+        Load the state saved by checkpoint_state. The player's memory is put back
+        once the agents are created.
+        """
+        self.curr_game_output = state["curr_game_output"]
+        self.game_tasks = state["game_tasks"]
+        self.completed_tasks = state["completed_tasks"]
+        self.current_task = state["current_task"]
+        self.turns = state["turns"]
+        self.task_updates = state["task_updates"]
+        self.resumed_memory = state["player_memory"]
+        self.room_graph.observed.update(state["room_graph_observed"])
+        self.navigation_failed_task = state["navigation_failed_task"]
+        self.completion_stats = state["completion_stats"]
+        self.navigation_stats = state["navigation_stats"]
+        self.observations = state.get("observations") or self.observations
+        if self.loop_detector and state.get("loop_detector"):
+            self.loop_detector = state["loop_detector"]
+        if self.speculator and state.get("speculator"):
+            self.speculator = state["speculator"]
+
+    def save_checkpoint(self):
+        save_checkpoint(self.checkpoint_path, self.checkpoint_state())
+
     def run(self, user_input:str) -> str:
         """
         For use as a tool for LangChain agent 
         """
         if not self.game.is_finished:
             # Ask Player Agent what to do next
-            self.history.append({"role": "assistant", "content": user_input})
+            self.record_history("assistant", user_input)
            
-            # split lines by newlines and periods and flatten list
-            newline_split = user_input.lower().split('\n')
-            period_split = [ line.split('.') for line in newline_split ]
-            split_lines = functools.reduce(operator.iconcat, period_split, []) 
-            
             # We got input! Act on it.
-            for line in split_lines:
-                words = re.findall(r'\w+', line)
-                if words:
-                    self.curr_game_output = self.game.do_command(words)
-                    self.history.append({
-                        "role": "system", "content": self.curr_game_output
-                    })
-                    self.baudout(f"> {line}\n\n")
-                    self.baudout(self.curr_game_output)
+            if not any([self.execute_command(line) for line in split_commands(user_input)]):
+                self.reject_response()
         else:
             return "COMPLETED"
 
+    def parse_command(self, line: str) -> list:
+        """
+        The words of a command line to send to the game, empty if there are none
+        """
+        if self.validator:
+            return self.validator.validate(line, yesno=self.game.yesno_callback is not None) or []
+        return re.findall(r'\w+', line)
+
+    def execute_command(self, line: str) -> bool:
+        """
+        Send one command line to the game, recording the move on the room graph
+
+        Returns:
+            bool: whether the line contained a command
+        """
+        return self.send_command(self.parse_command(line))
+
+    def send_command(self, words: list) -> bool:
+        """
+        Send the words of a command to the game, recording the move on the room graph
+
+        Returns:
+            bool: whether there was a command to send
+        """
+        if not words:
+            return False
+
+        from_room = getattr(self.game, 'loc', None)
+        with self.metrics.timer("loop.engine"):
+            self.curr_game_output = self.game.do_command(words)
+        self.room_graph.record(from_room, " ".join(words), getattr(self.game, 'loc', None))
+        self.observations.add(self.curr_game_output, self.turns)
+        if self.loop_detector and self.loop_detector.observe(self.game, self.curr_game_output):
+            self.stuck = True
+        if self.speculator:
+            self.speculator.visit(self.game)
+        self.record_history("system", self.curr_game_output, command=" ".join(words))
+        self.baudout(f"> {' '.join(words)}\n\n")
+        self.baudout(self.curr_game_output)
+        return True
+
+    def reject_response(self):
+        """
+        Tell the player that nothing in its response was a command, without
+        spending a game turn on it
+        """
+        self.curr_game_output = NOT_A_COMMAND
+        self.baudout(NOT_A_COMMAND)
+
+    async def navigate(self, route: Route):
+        """
+        Walk a precomputed route locally, without asking the PlayerAgent for each
+        step. Stops early if the game doesn't take us where the map expected.
+        """
+        game_output = self.curr_game_output
+        commands = "\n".join(command for command, _ in route)
+        self.record_history("assistant", commands)
+
+        for command, expected in route:
+            self.execute_command(command)
+            if self.game.is_finished or self.game.loc.n != expected:
+                # don't keep trying the same route, let the player take over
+                self.navigation_failed_task = self.current_task
+                break
+
+        # keep the player's memory consistent with what happened
+        self.player_agent.memory.save_context({"input": game_output}, {"response": commands})
+        self.navigation_stats["routes"] += 1
+        self.navigation_stats["steps"] += len(route)
+        await self.process_local_moves()
+
+    def recall_observations(self) -> str:
+        """
+        Past game outputs relevant to the current task that have dropped out of
+        the player's verbatim memory
+        """
+        if not self.recall or not self.current_task:
+            return ""
+        with self.metrics.timer("loop.recall"):
+            recent = len(self.player_agent.memory.chat_memory.messages) // 2
+            return self.observations.recall(self.current_task, self.recall, before_turn=self.turns - recent)
 
     def next_game_task(self):
         """
         Get the next game task
         """
-        print("***************** TASK LIST *******************")
-        print(self.game_tasks)
-        print()
+        self.output.write("***************** TASK LIST *******************\n", paced=False)
+        self.output.write(f"{self.game_tasks}\n\n", paced=False)
         if self.current_task:
             self.completed_tasks.append({"task_name": self.current_task})
+            self.game_tasks.complete(self.current_task)
 
+        # with no tasks left there is no objective, rather than a finished one
         next_task = self.game_tasks.popleft()
-        if next_task:
-            self.current_task = next_task["task_name"]
+        self.current_task = next_task["task_name"] if next_task else None
 
     def baudout(self, s: str):
         """"
-        Output text like an old-school terminal
+        Output text through the selected output backend
+        """
+        with self.metrics.timer("loop.output"):
+            self.output.write(s)
+
+    def close(self, drain: bool = True):
+        """
+        Finish drawing any queued output, close the response cache and report
+        on the rate limiter and the metrics
+
+        Args:
+            drain (bool): draw output still waiting in the display's queue,
+                rather than dropping it
         """
-        out = sys.stdout
-        for c in s:
-            sleep(9. / BAUD)  # 8 bits + 1 stop bit @ the given baud rate
-            out.write(c)
-            out.flush()
+        if self.cache:
+            self.output.write(f"\n{self.cache}\n", paced=False)
+            self.cache.close()
+        if self.validator:
+            self.output.write(f"\n{self.validator}\n", paced=False)
+        if self.loop_detector:
+            self.output.write(f"\n{self.loop_detector}\n", paced=False)
+        if self.speculator:
+            self.output.write(f"\n{self.speculator}\n", paced=False)
+        if isinstance(self.limiter, RateLimiter):
+            self.output.write(f"\n{self.limiter}\n", paced=False)
+        if self.profile:
+            self.output.write(f"\n{self.metrics.report()}\n", paced=False)
+        if self.metrics_path:
+            self.metrics.dump(self.metrics_path)
+        self.output.close(drain)
+
+    def report_metrics(self):
+        """
+        Print a one line summary of the metrics so far, and refresh the metrics file
+        """
+        self.output.write(f"\n{self.metrics.brief()}\n", paced=False)
+        if self.metrics_path:
+            self.metrics.dump(self.metrics_path)
+
+    def record_history(self, role: str, content: str, **extra):
+        """
+        Append a message to the history log, tagged with the current turn
+        """
+        self.history.append({"turn": self.turns, "role": role, "content": content, **extra})
 
     def dump_history(self):
         """
-        Pretty print game output to a file
+        Flush the remaining history to the output file
         """
-        with open(self.output_file_path, 'w') as f:
-            pprint.pprint(self.history, stream=f)
+        self.history.close()
 
-    def loop(self):
+    async def update_game_tasks(self, rerank: bool = False):
         """
-        Main Game Loop
+        Come up with new tasks based on the latest game output and reprioritize
+        the task list. Prioritization has to wait on the new tasks.
+        When rerank_every is 0 every update re-ranks the whole list.
         """
-        # initialize agents 
-        self.game_task_creation_agent = GameTaskCreationAgent(self.verbose)
-        self.walkthrough_game_task_creation_agent = WalkthroughGameTaskCreationAgent(self.verbose)
-        self.prioritization_agent = PrioritizationAgent(self.verbose)
-        self.player_agent = PlayerAgent(self.verbose)
-        self.task_completion_agent = TaskCompletionAgent(self.verbose)
-        
-        print("***************** INITIALIZING GAME *******************") 
-        # if usng walkthrough, read into memory in chunks of 500ish tokens
-        # and pass to walkthrough gametask agent, else use gametask_creation_agent
-        # with the limited history
-        if self.walkthrough_path:
-            chunk_size = 300
-            chunk_overlap = 10
-            
+        new_tasks = await self.game_task_creation_agent.arun(self.player_agent.memory, self.curr_game_output)
+
+        # re-rank the whole list only every rerank_every updates, otherwise slot the
+        # new tasks into the head of the already ranked list
+        self.task_updates += 1
+        if rerank or not self.rerank_every or self.task_updates % self.rerank_every == 0:
+            self.game_tasks = SingleTaskListStorage.concat(self.game_tasks, new_tasks)
+            self.game_tasks = await self.prioritization_agent.arun(self.game_tasks)
+        else:
+            self.game_tasks = await self.prioritization_agent.arun_incremental(
+                self.game_tasks, new_tasks, self.prioritization_window
+            )
+
+    async def check_task_completion(self) -> bool:
+        """
+        Decide whether the current task is complete, from the game state when a
+        rule can tell and from the TaskCompletionAgent otherwise
+        """
+        if not self.current_task:
+            # nothing to judge, move on once new tasks have been added
+            return not self.game_tasks.is_empty()
+
+        if self.completion_rules:
+            completed = check_completion(self.game, self.current_task)
+            if completed is not None:
+                self.completion_stats["rules"] += 1
+                return completed
+
+        self.completion_stats["llm"] += 1
+        return await self.task_completion_agent.arun(self.current_task, self.player_agent.memory, self.curr_game_output)
+
+    async def timed(self, name: str, call):
+        """
+        Await a call, timing it under name
+        """
+        with self.metrics.timer(name):
+            return await call
+
+    async def process_command_result(self):
+        """
+        Run the agents that react to a game command. The completion check does not
+        depend on the task list updates, so they run concurrently.
+        """
+        calls = [self.timed("loop.completion_check", self.check_task_completion())]
+
+        # if not using a walthrough, come up with more tasks and prioritize
+        if not self.walkthrough_path:
+            calls.append(self.timed("loop.task_update", self.update_game_tasks()))
+
+        completed, *_ = await asyncio.gather(*calls)
+        if completed:
+            self.next_game_task()
+
+    async def process_local_moves(self):
+        """
+        React to commands the loop made by itself, such as a navigated route or
+        a stuck loop escape. With fused turns the agents are left alone: the next
+        turn's completion rules and TurnAgent call judge the task and add tasks.
+        """
+        if not self.fused:
+            await self.process_command_result()
+
+    async def ingest_walkthrough(self) -> SingleTaskListStorage:
+        """
+        Load the walkthrough's tasks from its compiled plan. A plan file can be
+        given directly; otherwise the plan kept next to the walkthrough is used,
+        after compiling whatever chunks of the walkthrough changed since.
+        """
+        if self.walkthrough_path.endswith(PLAN_SUFFIX):
+            plan = load_plan(self.walkthrough_path)
+            if plan is None:
+                raise ValueError(f"{self.walkthrough_path} is not a plan file")
+        else:
             with open(self.walkthrough_path, 'r') as f:
                 walkthrough = f.read()
-                text_splitter = CharacterTextSplitter.from_tiktoken_encoder(
-                    chunk_size=chunk_size, chunk_overlap=chunk_overlap
-                )
-                text_chunks = text_splitter.split_text(walkthrough)
-
-            for chunk in text_chunks:
-                tasks = self.walkthrough_game_task_creation_agent.run(chunk)
-                self.game_tasks.concat(tasks)
+            plan_path = plan_path_for(self.walkthrough_path)
+            plan = load_plan(plan_path)
+            if not is_current(plan, walkthrough):
+                # only now is the agent, and LangChain with it, needed
+                plan = await compile_plan(walkthrough, self.walkthrough_game_task_creation_agent, plan,
+                                          self.walkthrough_workers, source=self.walkthrough_path)
+                save_plan(plan, plan_path)
+        return SingleTaskListStorage.concat(self.game_tasks, plan["tasks"])
+
+    def loop(self):
+        """
+        Main Game Loop
+        """
+        asyncio.run(self.aloop())
+
+    async def aloop(self):
+        """
+        Async Main Game Loop, sharing one pool of connections to the model service
+        """
+        async with self.provider.connection_pool():
+            await self.play()
+
+    async def play(self):
+        """
+        Play until the game is won or the turn limit is reached
+        """
+        if self.resumed:
+            self.output.write("***************** RESUMING GAME *******************\n", paced=False)
+            self.baudout(self.curr_game_output)
         else:
-            self.game_tasks = self.game_task_creation_agent.run(self.player_agent.memory, self.curr_game_output)
+            self.output.write("***************** INITIALIZING GAME *******************\n", paced=False)
+            # with a walkthrough the tasks come from its compiled plan, compiling
+            # any chunks that changed first, else the GameTaskCreationAgent makes
+            # them up from the opening game output
+            if self.walkthrough_path:
+                self.game_tasks = await self.ingest_walkthrough()
+            else:
+                initial_tasks = await self.game_task_creation_agent.arun(self.player_agent.memory, self.curr_game_output)
+                self.game_tasks = SingleTaskListStorage.concat(self.game_tasks, initial_tasks)
 
-        self.next_game_task()
-        self.baudout(self.curr_game_output)
-        self.history.append({
-            "role": "system", "content": self.curr_game_output
-        })
+            self.next_game_task()
+            self.baudout(self.curr_game_output)
+            self.record_history("system", self.curr_game_output)
+            self.observations.add(self.curr_game_output, self.turns)
 
         while not self.game.is_finished:
-            # Ask Player Agent what to do next
-            result = self.player_agent.run(self.current_task, self.curr_game_output, self.completed_tasks)
-            self.history.append({"role": "assistant", "content": result})
-           
-            # split lines by newlines and periods and flatten list
-            newline_split = result.lower().split('\n')
-            period_split = [ line.split('.') for line in newline_split ]
-            split_lines = functools.reduce(operator.iconcat, period_split, []) 
-            
-            # We got input! Act on it.
-            for line in split_lines:
-                words = re.findall(r'\w+', line)
-                if words:
-                    self.curr_game_output = self.game.do_command(words)
-                    self.history.append({
-                        "role": "system", "content": self.curr_game_output
-                    })
-                    self.baudout(f"> {line}\n\n")
-                    self.baudout(self.curr_game_output)
-
-                    # if not using a walthrough, come up with more tasks and prioritize
-                    if not self.walkthrough_path:
-                        new_tasks = self.game_task_creation_agent.run(self.player_agent.memory, self.curr_game_output)
-                        curr_tasks = self.game_tasks
-                        self.game_tasks = SingleTaskListStorage.concat(curr_tasks, new_tasks)
-                        self.game_tasks = self.prioritization_agent.run(self.game_tasks)
-                    
-                    completed = self.task_completion_agent.run(self.current_task, self.player_agent.memory, self.curr_game_output)
-                    if completed:
-                        self.next_game_task()
\ No newline at end of file
+            if self.max_turns is not None and self.turns >= self.max_turns:
+                break
+            if self.checkpoint_path and self.turns % self.checkpoint_every == 0:
+                with self.metrics.timer("loop.checkpoint"):
+                    self.save_checkpoint()
+            self.turns += 1
+
+            with self.metrics.timer("loop.turn"):
+                await self.play_turn()
+
+            if self.metrics_every and self.turns % self.metrics_every == 0:
+                self.report_metrics()
+
+    async def play_streamed(self):
+        """
+        Act on each of the PlayerAgent's commands as soon as it has been
+        generated, and stop the generation after commands_per_turn commands
+        """
+        commands = self.player_agent.astream(self.current_task, self.curr_game_output, self.completed_tasks,
+                                             self.recall_observations(), self.commands_per_turn)
+        executed = False
+        async for line in commands:
+            self.record_history("assistant", line)
+            if self.execute_command(line):
+                executed = True
+                await self.process_command_result()
+        if not executed:
+            self.reject_response()
+
+    async def play_speculated(self):
+        """
+        Ask the PlayerAgent for several candidate commands, try each one on a
+        copy of the game and play only the one that does the most
+        """
+        result = await self.player_agent.arun(self.current_task, self.curr_game_output, self.completed_tasks,
+                                              self.recall_observations(), self.speculate)
+        self.record_history("assistant", result)
+
+        candidates = []
+        for line in split_commands(result):
+            words = self.parse_command(line)
+            if words and words not in candidates:
+                candidates.append(words)
+        with self.metrics.timer("loop.speculate"):
+            chosen = self.speculator.choose(self.game, candidates[:self.speculate])
+        if not chosen:
+            self.reject_response()
+            return
+
+        # the player remembers the command that was played, not the ones it passed over
+        self.player_agent.memory.revise_response(" ".join(chosen))
+        self.send_command(chosen)
+        await self.process_command_result()
+
+    async def play_fused(self):
+        """
+        Play a turn with a single TurnAgent call, which judges the objective,
+        suggests new tasks and picks the next command from the latest output.
+        The completion rules still get the first say, since they are free.
+        """
+        decided = None
+        if self.completion_rules and self.current_task:
+            decided = check_completion(self.game, self.current_task)
+            if decided is not None:
+                self.completion_stats["rules"] += 1
+                if decided:
+                    self.next_game_task()
+
+        turn = await self.turn_agent.arun(self.current_task, self.curr_game_output, self.completed_tasks,
+                                          self.game_tasks, self.recall_observations())
+        if decided is None and self.current_task and turn["complete"] is not None:
+            self.completion_stats["llm"] += 1
+            if turn["complete"]:
+                self.next_game_task()
+
+        # new tasks come from what is in front of the player, so they go first
+        if turn["new_tasks"] and not self.walkthrough_path:
+            self.task_updates += 1
+            self.game_tasks = self.game_tasks.copy(turn["new_tasks"] + self.game_tasks.tasks)
+            if not self.current_task:
+                self.next_game_task()
+
+        self.record_history("assistant", turn["command"])
+        if not any([self.execute_command(line) for line in split_commands(turn["command"])]):
+            self.reject_response()
+
+    def skip_task(self) -> bool:
+        """
+        Put the current task at the back of the list and move on to the next one
+
+        Returns:
+            bool: whether there was another task to move on to
+        """
+        next_task = self.game_tasks.popleft()
+        if not next_task:
+            return False
+        skipped, self.current_task = self.current_task, next_task["task_name"]
+        if skipped:
+            self.game_tasks.append(skipped)
+        return True
+
+    async def escape(self) -> bool:
+        """
+        Break out of a loop the player is stuck in, without asking the LLM why.
+        The first time on a task the player is walked out of the room, then the
+        task is put aside, and then the task list is replanned from scratch.
+        With fused turns no escape calls the task agents: the TurnAgent judges
+        an exploration move on the next turn, and replanning becomes skipping.
+
+        Returns:
+            bool: whether the escape used up the turn with a move of its own
+        """
+        self.stuck = False
+        policy = self.loop_detector.escape(self.current_task)
+        if policy == "explore":
+            command = self.room_graph.exploration_move(self.game, self.loop_detector.stats["explore"])
+            if command is None:
+                policy = self.loop_detector.escape(self.current_task)
+        if policy == "replan" and (self.walkthrough_path or self.fused):
+            # a walkthrough is the plan, and the fused agent replans every turn
+            policy = "skip"
+
+        self.loop_detector.stats[policy] += 1
+        with self.metrics.timer(f"loop.escape.{policy}"):
+            if policy == "explore":
+                game_output = self.curr_game_output
+                self.record_history("assistant", command)
+                self.execute_command(command)
+                self.player_agent.memory.save_context({"input": game_output}, {"response": command})
+                await self.process_local_moves()
+                return True
+            if policy == "skip":
+                self.skip_task()
+            else:
+                await self.update_game_tasks(rerank=True)
+                self.skip_task()
+            self.curr_game_output = STUCK_NOTE + self.curr_game_output
+            return False
+
+    async def play_turn(self):
+        """
+        Make one move, either a locally planned route or the PlayerAgent's commands
+        """
+        if self.stuck and await self.escape():
+            return
+
+        # Walk to "go to X" objectives locally when the map knows the way
+        if self.navigation and self.current_task != self.navigation_failed_task:
+            route = self.room_graph.route_to(self.game, self.current_task)
+            if route:
+                with self.metrics.timer("loop.navigation"):
+                    await self.navigate(route)
+                return
+
+        if self.fused:
+            await self.play_fused()
+            return
+
+        if self.stream:
+            await self.play_streamed()
+            return
+
+        if self.speculator:
+            await self.play_speculated()
+            return
+
+        # Ask Player Agent what to do next
+        result = await self.player_agent.arun(self.current_task, self.curr_game_output, self.completed_tasks,
+                                              self.recall_observations())
+        self.record_history("assistant", result)
+
+        # We got input! Act on it.
+        executed = False
+        for line in split_commands(result):
+            if self.execute_command(line):
+                executed = True
+                await self.process_command_result()
+        if not executed:
+            self.reject_response()
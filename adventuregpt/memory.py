@@ -0,0 +1,214 @@
+"""
+Conversation memory that stays within a token budget
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import re
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.schema import AIMessage, BaseMessage, SystemMessage, get_buffer_string
+from pydantic import Field, PrivateAttr
+
+from adventuregpt.ratelimit import CHARS_PER_TOKEN
+
+# paragraphs shorter than this are cheaper to repeat than to reference
+MIN_REFERENCE_LENGTH = 80
+REFERENCE_LENGTH = 48
+
+
+def count_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def first_sentence(text: str, limit: int = REFERENCE_LENGTH) -> str:
+    """
+    The start of a text, up to its first full stop or newline. References to
+    earlier paragraphs start the same way as the paragraph itself.
+    """
+    sentence = re.split(r'(?<=[.!?])\s|\n', text.strip().lstrip("("), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "..."
+
+
+def format_history_message(msg: BaseMessage) -> str:
+    """
+    Format one message the way LangChain does for ConversationChains w/ memory
+    """
+    content = msg.content.rstrip('\n')
+    if msg.type == "ai":
+        return f"{msg.type.upper()}: {content}\n"
+    if msg.type == "human":
+        return f"{msg.type.capitalize()}: {content}\n\n\n"
+    return f"{msg.type.capitalize()}: {content}\n"
+
+
+class BudgetedSummaryMemory(BaseChatMemory):
+    """
+    Keeps up to k recent exchanges verbatim while they fit in max_tokens. Older
+    exchanges are rolled into a running summary, one short line per move, which
+    is itself capped at summary_tokens. Room descriptions and other long
+    paragraphs the game has already shown are stored as a short reference
+    instead of in full.
+
+    The history is also kept pre-formatted for text prompts, one segment per
+    message, so render only formats messages added since the last call and
+    repeated calls between changes return the same string.
+    """
+
+    max_tokens: int = 600
+    summary_tokens: int = 100
+    k: int = 15
+    memory_key: str = "history"
+    summary: List[str] = Field(default_factory=list)
+    omitted: int = 0
+    seen: Dict[str, str] = Field(default_factory=dict)
+    _summary_message: Optional[SystemMessage] = PrivateAttr(default=None)
+    _segments: Deque[str] = PrivateAttr(default_factory=deque)
+    _rendered: Optional[str] = PrivateAttr(default=None)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def summary_message(self) -> Optional[SystemMessage]:
+        if self._summary_message is None and (self.summary or self.omitted):
+            self._summary_message = SystemMessage(content=self.summary_text())
+        return self._summary_message
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        messages = list(self.chat_memory.messages)
+        if self.summary_message() is not None:
+            messages.insert(0, self.summary_message())
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {self.memory_key: get_buffer_string(messages)}
+
+    def summary_text(self) -> str:
+        lines = ["Summary of earlier moves:"]
+        if self.omitted:
+            lines.append(f"({self.omitted} earlier moves not shown)")
+        lines.extend(self.summary)
+        return "\n".join(lines)
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self.chat_memory.add_user_message(self.dedupe(input_str))
+        self.chat_memory.add_ai_message(output_str)
+        self._rendered = None
+        self.prune()
+
+    def revise_response(self, response: str):
+        """
+        Replace the latest response, e.g. with the one command that was acted on
+        out of several the model suggested
+        """
+        messages = self.chat_memory.messages
+        if not messages or messages[-1].type != "ai":
+            return
+        messages[-1] = AIMessage(content=response)
+        if len(self._segments) == len(messages):
+            self._segments[-1] = format_history_message(messages[-1])
+        self._rendered = None
+
+    def render(self) -> str:
+        """
+        The summary and recent messages formatted for a text prompt
+        """
+        if self._rendered is None:
+            messages = self.chat_memory.messages
+            if len(self._segments) != len(messages):
+                # the messages were replaced wholesale, format them all again
+                self._segments = deque(format_history_message(m) for m in messages)
+            summary = self.summary_message()
+            self._rendered = "".join(
+                ([format_history_message(summary)] if summary is not None else []) + list(self._segments)
+            )
+        return self._rendered
+
+    def dedupe(self, text: str) -> str:
+        """
+        Replace long paragraphs that have been seen before with a reference
+        """
+        paragraphs = []
+        for paragraph in text.split("\n\n"):
+            key = " ".join(paragraph.split())
+            if len(key) < MIN_REFERENCE_LENGTH:
+                paragraphs.append(paragraph)
+            elif key in self.seen:
+                paragraphs.append(self.seen[key])
+            else:
+                self.seen[key] = f"({first_sentence(key)} as described before)"
+                paragraphs.append(paragraph)
+        return "\n\n".join(paragraphs)
+
+    def buffer_tokens(self) -> int:
+        return sum(count_tokens(m.content) for m in self.chat_memory.messages)
+
+    def prune(self):
+        """
+        Roll the oldest exchanges into the summary until the buffer fits
+        """
+        messages = self.chat_memory.messages
+        while len(messages) > 2 and (len(messages) > 2 * self.k or self.buffer_tokens() > self.max_tokens):
+            game_output, command = messages.pop(0), messages.pop(0)
+            if len(self._segments) >= 2:
+                self._segments.popleft()
+                self._segments.popleft()
+            self.add_summary(f"{first_sentence(game_output.content)} > {command.content.strip()}")
+
+        while len(self.summary) > 1 and count_tokens("\n".join(self.summary)) > self.summary_tokens:
+            self.summary.pop(0)
+            self.omitted += 1
+            self._summary_message = None
+
+        # only format the messages that are new since the last prune
+        for message in messages[len(self._segments):]:
+            self._segments.append(format_history_message(message))
+
+    def add_summary(self, line: str):
+        """
+        Add a move to the summary, counting repeats of the previous move
+        rather than listing them again
+        """
+        self._summary_message = None
+        if self.summary:
+            previous, _, repeats = self.summary[-1].partition(" (x")
+            if previous == line:
+                count = int(repeats.rstrip(")")) if repeats else 1
+                self.summary[-1] = f"{line} (x{count + 1})"
+                return
+        self.summary.append(line)
+
+    def state(self) -> Dict[str, Any]:
+        """
+        Everything needed to restore the memory, for checkpoints
+        """
+        return {
+            "messages": list(self.chat_memory.messages),
+            "summary": list(self.summary),
+            "omitted": self.omitted,
+            "seen": dict(self.seen),
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        self.chat_memory.messages = list(state["messages"])
+        self.summary = list(state.get("summary", []))
+        self.omitted = state.get("omitted", 0)
+        self.seen = dict(state.get("seen", {}))
+        self._reset_rendering()
+
+    def _reset_rendering(self):
+        self._summary_message = None
+        self._segments = deque()
+        self._rendered = None
+
+    def clear(self) -> None:
+        super().clear()
+        self.summary = []
+        self.omitted = 0
+        self.seen = {}
+        self._reset_rendering()
@@ -0,0 +1,116 @@
+"""
+Timings and counters for agent calls and game loop phases
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import contextlib
+import json
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, List, Sequence
+
+# counters kept for every timed name, agents fill in the token and cache ones
+COUNTERS = ("prompt_tokens", "completion_tokens", "cost", "cache_hits", "retries")
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    """
+    Linearly interpolated percentile of already sorted samples
+    """
+    if not samples:
+        return 0.0
+    position = (len(samples) - 1) * q / 100.
+    lower = int(position)
+    upper = min(lower + 1, len(samples) - 1)
+    return samples[lower] + (samples[upper] - samples[lower]) * (position - lower)
+
+
+class Metrics:
+    """
+    Collects the wall time of every agent call and loop phase under a name,
+    e.g. "PlayerAgent" or "engine", along with the tokens, cost, cache hits and
+    retries of each LLM call
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.counters: Dict[str, Dict[str, float]] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[Dict[str, float]]:
+        """
+        Time the block under name. The block can fill in counters on the dict it
+        is given, which are added to the totals when it ends.
+        """
+        counts = {}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.record(name, time.perf_counter() - start, **counts)
+
+    def record(self, name: str, seconds: float, **counts: float):
+        self.samples[name].append(seconds)
+        totals = self.counters[name]
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per name call counts, wall time percentiles and counter totals, in seconds
+        """
+        summary = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            summary[name] = {
+                "calls": len(ordered),
+                "total": sum(ordered),
+                "mean": sum(ordered) / len(ordered),
+                "p50": percentile(ordered, 50),
+                "p90": percentile(ordered, 90),
+                "p99": percentile(ordered, 99),
+                "max": ordered[-1],
+                **self.counters[name],
+            }
+        return summary
+
+    def brief(self) -> str:
+        """
+        One line summary of where the time has gone so far
+        """
+        summary = self.summary()
+        elapsed = time.perf_counter() - self.started
+        tokens = sum(s["prompt_tokens"] + s["completion_tokens"] for s in summary.values())
+        cost = sum(s["cost"] for s in summary.values())
+        busiest = sorted(summary.items(), key=lambda item: item[1]["total"], reverse=True)[:3]
+        top = ", ".join(f"{name} {s['total']:.1f}s" for name, s in busiest)
+        return f"[metrics] {elapsed:.1f}s elapsed, {tokens} tokens, ${cost:.4f}; {top}"
+
+    def report(self) -> str:
+        """
+        Table of every timed name, slowest total first
+        """
+        header = (
+            f"{'name':<34}{'calls':>7}{'total s':>10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+            f"{'prompt tok':>12}{'compl tok':>11}{'cost $':>9}{'cached':>8}{'retries':>9}"
+        )
+        lines = [header, "-" * len(header)]
+        summary = self.summary()
+        for name, s in sorted(summary.items(), key=lambda item: item[1]["total"], reverse=True):
+            lines.append(
+                f"{name:<34}{s['calls']:>7}{s['total']:>10.3f}{s['p50'] * 1000:>9.1f}{s['p90'] * 1000:>9.1f}"
+                f"{s['p99'] * 1000:>9.1f}{s['prompt_tokens']:>12}{s['completion_tokens']:>11}{s['cost']:>9.4f}"
+                f"{s['cache_hits']:>8}{s['retries']:>9}"
+            )
+        return "\n".join(lines)
+
+    def dump(self, path: str):
+        """
+        Write the summary to a JSON file
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"elapsed": time.perf_counter() - self.started, "metrics": self.summary()}, f, indent=2)
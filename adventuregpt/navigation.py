@@ -0,0 +1,183 @@
+"""
+Room graph of the cave with shortest-path navigation
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from adventure.game import Game
+from adventure.model import Room
+
+from adventuregpt.collections import normalize_task_name
+from adventuregpt.rules import GO_VERBS, room_matches
+
+# a route is a list of (command, expected room number) steps
+Route = List[Tuple[str, int]]
+
+DIRECTIONS = {
+    "north", "south", "east", "west", "up", "down", "n", "s", "e", "w", "u", "d",
+    "ne", "nw", "se", "sw", "northeast", "northwest", "southeast", "southwest",
+}
+
+
+class RoomGraph:
+    """
+    Map of the cave built from the static travel table loaded by load_advent_dat
+    and from the moves actually observed while playing. Observed moves win over
+    the travel table, since they already account for conditions the table can't.
+    """
+
+    def __init__(self, game: Game):
+        self.observed: Dict[int, Dict[str, int]] = defaultdict(dict)
+        self.verbs: Dict[int, List[Tuple[str, list]]] = {}
+        for n, room in game.rooms.items():
+            self.verbs[n] = self._room_verbs(room)
+
+    @staticmethod
+    def _room_verbs(room: Room) -> List[Tuple[str, list]]:
+        """
+        Group a room's travel table by verb, keeping every move a verb can take
+        in table order so conditions can be checked when routing
+        """
+        by_verb = {}
+        for move in room.travel_table:
+            for verb in move.verbs:
+                by_verb.setdefault(verb.text, []).append(move)
+        return list(by_verb.items())
+
+    @staticmethod
+    def _condition_holds(game: Game, condition: tuple) -> Optional[bool]:
+        """
+        Evaluate a travel condition against the game, None when it is random
+        """
+        kind = condition[0]
+        if kind is None or kind == 'not_dwarf':
+            return True
+        if kind == '%':
+            return None
+        if kind == 'carrying':
+            return game.objects[condition[1]].is_toting
+        if kind == 'carrying_or_in_room_with':
+            return game.is_here(game.objects[condition[1]])
+        if kind == 'prop!=':
+            return game.objects[condition[1]].prop != condition[2]
+        return None
+
+    def _destination(self, game: Game, moves: list) -> Optional[Room]:
+        for move in moves:
+            holds = self._condition_holds(game, move.condition)
+            if holds is None:
+                return None
+            if holds:
+                if isinstance(move.action, Room) and not move.action.is_forced:
+                    return move.action
+                return None
+        return None
+
+    def record(self, from_room: Room, command: str, to_room: Room):
+        """
+        Remember where a command took the player
+        """
+        if from_room is not None and to_room is not None and from_room is not to_room:
+            self.observed[from_room.n][command] = to_room.n
+
+    def neighbours(self, game: Game, n: int) -> List[Tuple[str, int]]:
+        edges = dict(self.observed.get(n, {}))
+        for verb, moves in self.verbs.get(n, []):
+            if verb in edges:
+                continue
+            dest = self._destination(game, moves)
+            if dest is not None:
+                edges[verb] = dest.n
+        return list(edges.items())
+
+    def shortest_path(self, game: Game, is_goal: Callable[[Room], bool]) -> Optional[Route]:
+        """
+        Breadth first search from the player's room to the nearest room satisfying
+        is_goal. Dark rooms are avoided unless the player carries a lit lamp.
+
+        Returns:
+            Route: the moves to make, or None if no goal room is reachable
+        """
+        start = game.loc
+        if is_goal(start):
+            return []
+
+        lamp = game.objects['lamp']
+        has_light = lamp.is_toting and lamp.prop == 1
+
+        parents = {start.n: None}
+        queue = deque([start.n])
+        while queue:
+            n = queue.popleft()
+            for command, dest in self.neighbours(game, n):
+                if dest in parents:
+                    continue
+                room = game.rooms[dest]
+                if room.is_dark and not has_light:
+                    continue
+                parents[dest] = (n, command)
+                if is_goal(room):
+                    return self._unwind(parents, dest)
+                queue.append(dest)
+        return None
+
+    def exploration_move(self, game: Game, attempt: int = 0) -> Optional[str]:
+        """
+        A move out of the player's room, preferring rooms the player has never
+        left from, and so has probably never seen. Successive attempts take
+        different exits.
+
+        Returns:
+            str: a movement command, or None if the room has no known safe exit
+        """
+        if game.yesno_callback or getattr(game, 'loc', None) is None:
+            return None
+
+        lamp = game.objects['lamp']
+        has_light = lamp.is_toting and lamp.prop == 1
+        exits = [
+            (dest in self.observed, command) for command, dest in self.neighbours(game, game.loc.n)
+            if dest != game.loc.n and (has_light or not game.rooms[dest].is_dark)
+        ]
+        if not exits:
+            return None
+        exits.sort()
+        return exits[attempt % len(exits)][1]
+
+    @staticmethod
+    def _unwind(parents: dict, n: int) -> Route:
+        route = []
+        while parents[n] is not None:
+            prev, command = parents[n]
+            route.append((command, n))
+            n = prev
+        route.reverse()
+        return route
+
+    def route_to(self, game: Game, objective: str) -> Optional[Route]:
+        """
+        Expand a "go to X" objective into movement commands
+
+        Returns:
+            Route: the moves to make, or None if the objective isn't a known destination
+        """
+        if game.yesno_callback or getattr(game, 'loc', None) is None:
+            # the game is waiting on a yes/no answer, or hasn't placed the player yet
+            return None
+
+        words = normalize_task_name(objective or "").split()
+        if len(words) < 2 or words[0] not in GO_VERBS:
+            return None
+
+        rest = words[1:]
+        if all(w in DIRECTIONS for w in rest):
+            # plain directions are moves, not destinations
+            return None
+
+        route = self.shortest_path(game, lambda room: room_matches(room, rest))
+        return route or None
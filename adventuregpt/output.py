@@ -0,0 +1,144 @@
+"""
+Output backends for displaying game text
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import queue
+import sys
+import threading
+from time import sleep
+
+
+BAUD = 1200
+
+# most seconds the drawn text may fall behind the game before it catches up
+MAX_LAG = 5.0
+
+
+class InstantOutput:
+    """
+    Write text straight to the terminal, flushing after every write
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def write(self, s: str, paced: bool = True):
+        """
+        Write text to the stream
+
+        Args:
+            s (str): text to display
+            paced (bool): whether the backend may apply its cosmetic pacing
+        """
+        self.stream.write(s)
+        self.stream.flush()
+
+    def close(self, drain: bool = True):
+        self.stream.flush()
+
+
+class BufferedOutput(InstantOutput):
+    """
+    Write text to the terminal and leave flushing to the stream's own buffering
+    """
+
+    def write(self, s: str, paced: bool = True):
+        self.stream.write(s)
+
+
+class BaudOutput(InstantOutput):
+    """
+    Output text like an old-school terminal. Characters are drawn by a writer
+    thread so the game loop never waits on the effect. When the game gets more
+    than max_lag seconds of drawing ahead, queued text is written at once until
+    the display has caught up.
+    """
+
+    def __init__(self, stream=None, baud: int = BAUD, max_lag: float = MAX_LAG):
+        super().__init__(stream)
+        self.delay = 9. / baud  # 8 bits + 1 stop bit @ the given baud rate
+        self.max_backlog = int(max_lag / self.delay)
+        self.backlog = 0  # characters queued but not drawn yet
+        self.lock = threading.Lock()
+        self.hurry = threading.Event()  # set to stop pacing altogether
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._writer, daemon=True)
+        self.writer.start()
+
+    def write(self, s: str, paced: bool = True):
+        with self.lock:
+            self.backlog += len(s)
+        self.queue.put((s, paced))
+
+    def _drawn(self, n: int):
+        with self.lock:
+            self.backlog -= n
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            s, paced = item
+            for i, c in enumerate(s):
+                if not paced or self.backlog > self.max_backlog or self.hurry.is_set():
+                    # write the rest in one go
+                    self.stream.write(s[i:])
+                    self.stream.flush()
+                    self._drawn(len(s) - i)
+                    break
+                sleep(self.delay)
+                self.stream.write(c)
+                self.stream.flush()
+                self._drawn(1)
+
+    def close(self, drain: bool = True):
+        """
+        Stop the writer thread
+
+        Args:
+            drain (bool): finish drawing queued text before returning
+        """
+        if not drain:
+            self._drop()
+        self.queue.put(None)
+        try:
+            self.writer.join()
+        except KeyboardInterrupt:
+            # a Ctrl-C while draining stops the drawing too
+            self._drop()
+            self.queue.put(None)
+            self.writer.join()
+        self.stream.flush()
+
+    def _drop(self):
+        """
+        Drop anything still waiting to be drawn and finish the text being
+        drawn now without pacing
+        """
+        self.hurry.set()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+OUTPUT_BACKENDS = {
+    "instant": InstantOutput,
+    "buffered": BufferedOutput,
+    "baud": BaudOutput,
+}
+
+
+def make_output(mode: str = "baud", stream=None):
+    """
+    Build the output backend registered under the given name
+    """
+    try:
+        backend = OUTPUT_BACKENDS[mode]
+    except KeyError:
+        raise ValueError(f"Unknown output mode '{mode}', expected one of {', '.join(OUTPUT_BACKENDS)}")
+    return backend(stream)
@@ -0,0 +1,243 @@
+"""
+Compile walkthroughs into plan files the loop can load without any LLM calls
+
+A plan is the ordered task list the WalkthroughGameTaskCreationAgent makes
+from a walkthrough, stored as JSON along with where each task came from. It
+is keyed by the walkthrough's content hash and the agent's prompt version,
+and each chunk of the walkthrough is hashed too, so editing one section only
+recompiles the chunks that changed.
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import zlib
+from typing import Dict, List, Optional
+
+from adventuregpt.checkpoint import make_temp_file
+from adventuregpt.ratelimit import estimate_tokens
+
+PLAN_FORMAT = 1
+PLAN_SUFFIX = ".plan.json"
+
+# bump whenever the WalkthroughGameTaskCreationAgent prompt changes, so plans
+# made with the old prompt are recompiled
+PROMPT_VERSION = 1
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def plan_path_for(walkthrough_path: str) -> str:
+    """
+    Where the plan compiled from a walkthrough is kept by default
+    """
+    return walkthrough_path + PLAN_SUFFIX
+
+
+def split_walkthrough(text: str, min_tokens: int = 100, max_tokens: int = 400, spread: int = 4) -> List[str]:
+    """
+    Split a walkthrough into chunks of whole paragraphs. A chunk ends after a
+    paragraph picked by its hash, once it holds min_tokens, or when it reaches
+    max_tokens. Chunk boundaries depend on the text around them rather than on
+    everything before them, so an edit only moves the boundaries near it.
+
+    Args:
+        text (str): the walkthrough
+        min_tokens (int): smallest chunk, except at the end
+        max_tokens (int): largest chunk, give or take a paragraph
+        spread (int): roughly one paragraph in this many ends a chunk
+
+    Returns:
+        List[str]: the chunks, in order
+    """
+    units = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        if not paragraph.strip():
+            continue
+        if estimate_tokens(paragraph, 0) > max_tokens:
+            units.extend(line for line in paragraph.split("\n") if line.strip())
+        else:
+            units.append(paragraph.strip("\n"))
+
+    chunks, current, size = [], [], 0
+    for unit in units:
+        current.append(unit)
+        size += estimate_tokens(unit, 0)
+        if size >= max_tokens or (size >= min_tokens and zlib.crc32(unit.encode("utf-8")) % spread == 0):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def is_current(plan: Optional[Dict], walkthrough: str) -> bool:
+    """
+    Whether a plan was compiled from this exact walkthrough with the current prompt
+    """
+    return (
+        plan is not None
+        and plan.get("format") == PLAN_FORMAT
+        and plan.get("prompt_version") == PROMPT_VERSION
+        and plan.get("walkthrough_sha256") == content_hash(walkthrough)
+    )
+
+
+async def compile_plan(walkthrough: str, agent, previous: Optional[Dict] = None, workers: int = 4,
+                       source: str = "") -> Dict:
+    """
+    Turn a walkthrough into a plan, reusing the tasks of any chunk the previous
+    plan already compiled with the same prompt
+
+    Args:
+        walkthrough (str): the walkthrough text
+        agent (WalkthroughGameTaskCreationAgent): turns a chunk into tasks
+        previous (dict): an earlier plan of the same walkthrough
+        workers (int): chunks compiled at once
+        source (str): the walkthrough's path, for the record
+
+    Returns:
+        dict: the plan
+    """
+    reusable = {}
+    if previous and previous.get("format") == PLAN_FORMAT and previous.get("prompt_version") == PROMPT_VERSION:
+        reusable = {chunk["sha256"]: chunk["tasks"] for chunk in previous["chunks"]}
+
+    semaphore = asyncio.Semaphore(workers)
+
+    async def compile_chunk(text: str) -> List[str]:
+        key = content_hash(text)
+        if key in reusable:
+            return reusable[key]
+        async with semaphore:
+            return (await agent.arun(text)).get_task_names()
+
+    texts = split_walkthrough(walkthrough)
+    # gather returns results in the order the chunks were given
+    chunk_tasks = await asyncio.gather(*[compile_chunk(text) for text in texts])
+
+    chunks, tasks = [], []
+    for i, (text, names) in enumerate(zip(texts, chunk_tasks)):
+        key = content_hash(text)
+        chunks.append({
+            "sha256": key,
+            "first_line": text.strip().split("\n", 1)[0][:80],
+            "tokens": estimate_tokens(text, 0),
+            "compiled": key not in reusable,
+            "tasks": names,
+        })
+        tasks.extend({"task_name": name, "chunk": i} for name in names)
+
+    return {
+        "format": PLAN_FORMAT,
+        "prompt_version": PROMPT_VERSION,
+        "walkthrough_sha256": content_hash(walkthrough),
+        "source": source,
+        "model": getattr(agent.llm, "model_name", ""),
+        "chunks": chunks,
+        "tasks": tasks,
+    }
+
+
+def save_plan(plan: Dict, path: str):
+    """
+    Write a plan to a temporary file and move it into place
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = make_temp_file(directory, ".plan-")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_plan(path: str) -> Optional[Dict]:
+    """
+    Read a plan, or None if there is none or it is in a format we don't know
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return plan if plan.get("format") == PLAN_FORMAT else None
+
+
+def format_plan(plan: Dict) -> str:
+    lines = [
+        f"walkthrough {plan['walkthrough_sha256'][:12]}  prompt v{plan['prompt_version']}  "
+        f"model {plan['model'] or '-'}  {len(plan['chunks'])} chunks  {len(plan['tasks'])} tasks"
+    ]
+    for i, chunk in enumerate(plan["chunks"]):
+        lines.append(f"[{i}] {chunk['first_line']}")
+        lines.extend(f"    - {name}" for name in chunk["tasks"])
+    return "\n".join(lines)
+
+
+async def compile_file(walkthrough_path: str, plan_path: str, agent, workers: int = 4, force: bool = False) -> Dict:
+    """
+    Bring the plan file of a walkthrough up to date, compiling only what changed
+    """
+    with open(walkthrough_path, 'r') as f:
+        walkthrough = f.read()
+    previous = None if force else load_plan(plan_path)
+    if is_current(previous, walkthrough):
+        for chunk in previous["chunks"]:
+            chunk["compiled"] = False
+        return previous
+    plan = await compile_plan(walkthrough, agent, previous, workers, source=walkthrough_path)
+    save_plan(plan, plan_path)
+    return plan
+
+
+if __name__ == '__main__':
+    from adventuregpt.cache import ResponseCache
+    from adventuregpt.chain import WalkthroughGameTaskCreationAgent
+    from adventuregpt.providers import PROVIDERS
+
+    parser = argparse.ArgumentParser(
+        prog="AdventureGPT plans",
+        description="Compile walkthroughs into plan files the game loop loads directly"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compile_parser = subparsers.add_parser("compile", help="compile a walkthrough, or the chunks of it that changed")
+    compile_parser.add_argument("walkthrough_path")
+    compile_parser.add_argument("-o", "--plan_path", help=f"defaults to the walkthrough path plus {PLAN_SUFFIX}")
+    compile_parser.add_argument("-j", "--workers", type=int, default=4, help="chunks to compile at once")
+    compile_parser.add_argument("-p", "--provider", choices=PROVIDERS.keys(), default="openai")
+    compile_parser.add_argument("-c", "--cache_path", help="sqlite file used to cache LLM responses")
+    compile_parser.add_argument("-f", "--force", action="store_true", help="recompile every chunk")
+    show_parser = subparsers.add_parser("show", help="print a plan's chunks and tasks")
+    show_parser.add_argument("plan_path")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        plan = load_plan(args.plan_path)
+        print(format_plan(plan) if plan else f"{args.plan_path} is not a plan file")
+    else:
+        provider = PROVIDERS[args.provider]()
+        cache = ResponseCache(args.cache_path) if args.cache_path else None
+        agent = WalkthroughGameTaskCreationAgent(cache=cache, provider=provider)
+
+        async def main():
+            async with provider.connection_pool():
+                return await compile_file(args.walkthrough_path, args.plan_path or plan_path_for(args.walkthrough_path),
+                                          agent, args.workers, args.force)
+
+        plan = asyncio.run(main())
+        compiled = sum(chunk["compiled"] for chunk in plan["chunks"])
+        print(f"{compiled} of {len(plan['chunks'])} chunks compiled, {len(plan['tasks'])} tasks")
+        if cache:
+            cache.close()
@@ -0,0 +1,238 @@
+"""
+Model providers that build the LLMs the agents run on
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import contextlib
+import os
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
+
+from adventuregpt.history import read_history
+
+if TYPE_CHECKING:
+    from langchain.chat_models.base import BaseChatModel
+    from langchain.llms.base import BaseLLM
+
+OPENAI_TEMPERATURE = 0.0
+
+
+def resolve_api_key() -> str:
+    """
+    Find the OpenAI key, asking for it the first time a real model is needed
+    """
+    api_key = os.environ.get("OPENAI_API_KEY")
+
+    if not api_key:
+        api_key = input("OpenAI Key:")
+        os.environ["OPENAI_API_KEY"] = api_key
+
+    return api_key
+
+
+class OpenAIProvider:
+    """
+    Builds OpenAI completion and chat models
+
+    Args:
+        temperature (float): sampling temperature for every model
+        api_base (str): alternative API endpoint, e.g. a local stub server
+        max_retries (int): attempts per call made by the client itself, 1 when a
+            RateLimiter is doing the retrying
+        pool_size (int): connections kept open to the API while the loop runs
+    """
+
+    def __init__(self, temperature: float = OPENAI_TEMPERATURE, api_base: Optional[str] = None,
+                 max_retries: int = 6, pool_size: int = 16):
+        self.temperature = temperature
+        self.api_base = api_base
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        resolve_api_key()
+        kwargs = {"temperature": self.temperature, "max_retries": self.max_retries}
+        if self.api_base:
+            kwargs["openai_api_base"] = self.api_base
+        return kwargs
+
+    def llm(self, agent: str) -> "BaseLLM":
+        """
+        Completion model for the named agent
+        """
+        from langchain.llms import OpenAI
+        return OpenAI(**self._client_kwargs())
+
+    def chat_model(self, agent: str, streaming: bool = False) -> "BaseChatModel":
+        """
+        Chat model for the named agent, streaming tokens to callbacks if asked
+        """
+        from langchain.chat_models import ChatOpenAI
+        return ChatOpenAI(streaming=streaming, **self._client_kwargs())
+
+    @contextlib.asynccontextmanager
+    async def connection_pool(self):
+        """
+        Share one HTTP session between every async call made inside the block,
+        rather than opening a connection per request
+        """
+        import aiohttp
+        import openai
+
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            token = openai.aiosession.set(session)
+            try:
+                yield
+            finally:
+                openai.aiosession.reset(token)
+
+
+def echo_prioritized_tasks(prompt: str) -> str:
+    """
+    Scripted PrioritizationAgent response that keeps the task order unchanged
+    """
+    tasks = prompt.rsplit("These are the tasks :", 1)[-1].strip().split("\n")
+    return "\n".join(f"{i}. {task}" for i, task in enumerate(tasks, 1) if task.strip())
+
+
+def turn_response(command: str, complete: bool = False, new_tasks: Tuple[str, ...] = ()) -> str:
+    """
+    Scripted TurnAgent response in the format the agent is asked for
+    """
+    tasks = "\n".join(f"{i}. {task}" for i, task in enumerate(new_tasks, 1)) or "none"
+    return f"COMPLETE: {'yes' if complete else 'no'}\nNEW TASKS:\n{tasks}\nCOMMAND: {command}"
+
+
+def player_response(command: str) -> Callable[[str], str]:
+    """
+    Scripted PlayerAgent response, with a couple of weaker alternatives after
+    the command when the player is asked for several candidates
+    """
+    def respond(prompt: str) -> str:
+        if "different commands you could try next" in prompt:
+            return f"{command}\nlook\ninventory"
+        return command
+    return respond
+
+
+PLAYER_SCRIPT = [
+    "no", "enter building", "take lamp", "take keys", "take food", "take bottle",
+    "exit", "south", "south", "south", "unlock grate", "down", "west", "take cage",
+    "west", "light lamp", "west", "take rod", "east", "east", "up", "north",
+    "north", "north", "enter building", "drop rod", "exit",
+]
+
+# A short, deterministic opening that walks into the cave and back
+DEFAULT_SCRIPT = {
+    "GameTaskCreationAgent": ["1. Enter the building\n2. Take the lamp\n3. Find the grate"],
+    "WalkthroughGameTaskCreationAgent": ["1. Enter the building\n2. Take the lamp\n3. Take the keys"],
+    "PrioritizationAgent": [echo_prioritized_tasks],
+    "TaskCompletionAgent": ["INCOMPLETE", "INCOMPLETE", "COMPLETE"],
+    "PlayerAgent": [player_response(command) for command in PLAYER_SCRIPT],
+    # the same moves, judging every third objective complete like the TaskCompletionAgent
+    "TurnAgent": [
+        turn_response(command, complete=i % 3 == 2, new_tasks=("Find the grate",) if i % 5 == 0 else ())
+        for i, command in enumerate(PLAYER_SCRIPT)
+    ],
+}
+
+Response = Union[str, Callable[[str], str]]
+
+
+class FakeBackend:
+    """
+    Scripted stand-in for a model service. Each agent cycles through its own
+    list of responses; a response may be a callable that is given the prompt.
+    """
+
+    def __init__(self, script: Optional[Dict[str, List[Response]]] = None, latency: float = 0.0,
+                 completion_tokens: Optional[int] = None):
+        self.script = dict(DEFAULT_SCRIPT if script is None else script)
+        self.latency = latency
+        self.completion_tokens = completion_tokens
+        self.positions = defaultdict(int)
+        self.calls = defaultdict(int)
+        self.prompt_tokens = defaultdict(int)
+        self.generated_tokens = defaultdict(int)
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        # ~4 characters per token is close enough for English prompts
+        return max(1, len(text) // 4)
+
+    def respond(self, agent: str, prompt: str) -> Tuple[str, Dict]:
+        """
+        Produce the next scripted response for the agent along with its token usage
+        """
+        responses = self.script.get(agent) or [""]
+        response = responses[self.positions[agent] % len(responses)]
+        self.positions[agent] += 1
+        text = response(prompt) if callable(response) else response
+
+        prompt_tokens = self.count_tokens(prompt)
+        completion_tokens = self.completion_tokens if self.completion_tokens is not None else self.count_tokens(text)
+        self.calls[agent] += 1
+        self.prompt_tokens[agent] += prompt_tokens
+        self.generated_tokens[agent] += completion_tokens
+
+        return text, {
+            "token_usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+            "model_name": "fake",
+        }
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": sum(self.calls.values()),
+            "prompt_tokens": sum(self.prompt_tokens.values()),
+            "completion_tokens": sum(self.generated_tokens.values()),
+        }
+
+
+class FakeProvider:
+    """
+    Builds offline models that answer from a script, for benchmarks and for
+    exercising the loop without a live service
+    """
+
+    def __init__(self, script: Optional[Dict[str, List[Response]]] = None, latency: float = 0.0,
+                 completion_tokens: Optional[int] = None):
+        self.backend = FakeBackend(script, latency, completion_tokens)
+
+    @classmethod
+    def replay(cls, history_path: str, **kwargs) -> "FakeProvider":
+        """
+        Build a provider whose PlayerAgent, or TurnAgent, repeats the commands
+        from a history dump
+        """
+        script = dict(DEFAULT_SCRIPT)
+        script["PlayerAgent"] = [
+            entry["content"] for entry in read_history(history_path) if entry["role"] == "assistant"
+        ]
+        script["TurnAgent"] = [turn_response(command) for command in script["PlayerAgent"]]
+        return cls(script, **kwargs)
+
+    def llm(self, agent: str) -> "BaseLLM":
+        from adventuregpt.fake_models import FakeLLM
+        return FakeLLM(backend=self.backend, agent=agent)
+
+    def chat_model(self, agent: str, streaming: bool = False) -> "BaseChatModel":
+        from adventuregpt.fake_models import FakeChatModel
+        return FakeChatModel(backend=self.backend, agent=agent, streaming=streaming)
+
+    @contextlib.asynccontextmanager
+    async def connection_pool(self):
+        yield
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "fake": FakeProvider,
+}
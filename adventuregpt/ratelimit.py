@@ -0,0 +1,302 @@
+"""
+Limits on how many LLM calls the agents make, and how fast
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+# rough prompt size, close enough to budget against without running a tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(prompt: str, completion_tokens: int = 256) -> int:
+    """
+    Estimate the tokens a call will use, counting the prompt and the completion
+    the model is allowed to return, which is how the API counts against the
+    tokens per minute limit
+    """
+    return len(prompt) // CHARS_PER_TOKEN + completion_tokens
+
+
+class NoLimit:
+    """
+    Limiter that lets every call straight through
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def run(self, call: Callable[[], T], tokens: int = 0) -> T:
+        """
+        Make a call under the limiter
+
+        Args:
+            call: function making the LLM call
+            tokens (int): estimated tokens the call will use
+        """
+        with self:
+            return call()
+
+    async def arun(self, call: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """
+        Async version of run, call returns the awaitable to run
+        """
+        async with self:
+            return await call()
+
+
+class ConcurrencyLimiter(NoLimit):
+    """
+    Caps the number of LLM calls in flight with a semaphore. Given a
+    multiprocessing.Manager semaphore the cap is shared by every process the
+    limiter is handed to, so a pool of games stays within one API quota.
+
+    Async callers poll for a free slot instead of blocking the event loop, which
+    also means a cancelled call never takes a slot it can't give back.
+    """
+
+    def __init__(self, semaphore, poll_interval: float = 0.02):
+        self.semaphore = semaphore
+        self.poll_interval = poll_interval
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.semaphore.release()
+        return False
+
+    async def __aenter__(self):
+        while not self.semaphore.acquire(False):
+            await asyncio.sleep(self.poll_interval)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+        return False
+
+
+class TokenBucket:
+    """
+    Budget that refills continuously at a rate per minute, up to its capacity.
+    Reservations may overdraw the bucket; the caller then waits until the debt
+    is paid back, so callers are served in the order they asked.
+    """
+
+    def __init__(self, per_minute: float, capacity: float = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount from the bucket
+
+        Returns:
+            float: seconds to wait before the reservation may be used
+        """
+        self._refill()
+        self.level -= min(amount, self.capacity)
+        return max(0., -self.level / self.rate)
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether an OpenAI error is worth trying again: rate limits, timeouts,
+    connection failures and server side errors
+    """
+    import openai
+
+    if isinstance(error, (openai.error.RateLimitError, openai.error.Timeout, openai.error.TryAgain,
+                          openai.error.APIConnectionError, openai.error.ServiceUnavailableError)):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+class RateLimiter(NoLimit):
+    """
+    Shared gate for every LLM call in a process. Calls wait for room in the
+    requests per minute and tokens per minute buckets and for a concurrency
+    slot, and failed calls are retried with jittered exponential backoff. A
+    rate limit error pauses every caller, not just the one that hit it, so the
+    agents back off together instead of piling more requests onto the quota.
+
+    max_concurrent caps the calls in flight in this process, sync and async
+    alike; concurrency is an extra cap that may be shared with other processes.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 max_concurrent: int = None, max_retries: int = 6, backoff_base: float = 1.,
+                 backoff_max: float = 60., concurrency: ConcurrencyLimiter = None,
+                 retryable: Callable[[Exception], bool] = is_retryable):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency
+        self.max_concurrent = max_concurrent
+        self.slots = self._make_slots(max_concurrent)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retryable = retryable
+        self.paused_until = 0.
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.metrics = {
+            "calls": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "tokens_reserved": 0,
+            "max_queue_depth": 0,
+            "wait_seconds": 0.,
+        }
+
+    @staticmethod
+    def _make_slots(max_concurrent: int) -> ConcurrencyLimiter:
+        # a thread semaphore serves async callers too, they poll it
+        return ConcurrencyLimiter(threading.BoundedSemaphore(max_concurrent)) if max_concurrent else None
+
+    def __getstate__(self):
+        # locks can't be pickled; a limiter handed to another process gets its own slots
+        state = dict(self.__dict__)
+        state["slots"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.slots = self._make_slots(self.max_concurrent)
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Book the call against the budgets and return how long to wait first
+        """
+        wait = max(0., self.paused_until - time.monotonic())
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+            self.metrics["tokens_reserved"] += tokens
+        return wait
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """
+        Full jitter exponential backoff, or the server's Retry-After when it sent one
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = (getattr(error, "headers", None) or {}).get("retry-after")
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        import openai
+
+        if isinstance(error, openai.error.RateLimitError):
+            self.metrics["rate_limited"] += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+    def _enqueue(self):
+        self.queue_depth += 1
+        self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], self.queue_depth)
+
+    def _can_retry(self, attempt: int, error: Exception) -> bool:
+        if attempt < self.max_retries and self.retryable(error):
+            self.metrics["retries"] += 1
+            return True
+        self.metrics["failures"] += 1
+        return False
+
+    def run(self, call: Callable[[], T], tokens: int = 0) -> T:
+        attempt = 0
+        while True:
+            self._enqueue()
+            start = time.monotonic()
+            queued = True
+            try:
+                time.sleep(self._reserve(tokens))
+                with self.slots or NoLimit(), self.concurrency or NoLimit():
+                    self.queue_depth -= 1
+                    queued = False
+                    self.metrics["wait_seconds"] += time.monotonic() - start
+                    self.metrics["calls"] += 1
+                    self.in_flight += 1
+                    try:
+                        return call()
+                    finally:
+                        self.in_flight -= 1
+            except Exception as e:
+                if not self._can_retry(attempt, e):
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+            finally:
+                if queued:
+                    self.queue_depth -= 1
+
+    async def arun(self, call: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        attempt = 0
+        while True:
+            self._enqueue()
+            start = time.monotonic()
+            queued = True
+            try:
+                await asyncio.sleep(self._reserve(tokens))
+                async with self.slots or NoLimit(), self.concurrency or NoLimit():
+                    self.queue_depth -= 1
+                    queued = False
+                    self.metrics["wait_seconds"] += time.monotonic() - start
+                    self.metrics["calls"] += 1
+                    self.in_flight += 1
+                    try:
+                        return await call()
+                    finally:
+                        self.in_flight -= 1
+            except Exception as e:
+                if not self._can_retry(attempt, e):
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                attempt += 1
+            finally:
+                if queued:
+                    # cancelled or failed while still waiting for a slot
+                    self.queue_depth -= 1
+
+    def stats(self) -> Dict[str, float]:
+        return {**self.metrics, "queue_depth": self.queue_depth, "in_flight": self.in_flight}
+
+    def __str__(self):
+        m = self.metrics
+        return (
+            f"llm calls: {m['calls']}, retries: {m['retries']}, rate limited: {m['rate_limited']}, "
+            f"failed: {m['failures']}, max queue depth: {m['max_queue_depth']}, "
+            f"waited: {m['wait_seconds']:.1f}s"
+        )
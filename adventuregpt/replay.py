@@ -0,0 +1,185 @@
+"""
+Replay a recorded game history against the game engine, without any LLM calls
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import argparse
+import bisect
+import pickle
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from adventure.game import Game
+
+from adventuregpt.commands import split_commands
+from adventuregpt.engine import new_game
+from adventuregpt.history import read_history
+from adventuregpt.output import OUTPUT_BACKENDS, make_output
+
+
+class Replay:
+    """
+    Re-drives Game.do_command with the commands from a recorded history. A
+    turn index maps every turn to its first command, and the game state is
+    snapshotted every snapshot_every commands, so seeking to any turn restores
+    the nearest snapshot and replays at most snapshot_every commands.
+
+    The snapshots are taken by replaying the whole history once when it is
+    loaded. Pass index=False to skip that, e.g. when only verifying, and
+    snapshots are taken as commands are replayed instead.
+    """
+
+    def __init__(self, records: Iterable[Dict], snapshot_every: int = 25, index: bool = True):
+        self.seed = None
+        self.opening = ""
+        # (turn, words, recorded output)
+        self.commands: List[Tuple[int, List[str], str]] = []
+        self.snapshot_every = snapshot_every
+        self.snapshots: Dict[int, bytes] = {}
+        self._load(records)
+
+        # turn_index[t] is the position of the first command played on or after turn t
+        self.turn_index = []
+        for position, (turn, _, _) in enumerate(self.commands):
+            while len(self.turn_index) <= turn:
+                self.turn_index.append(position)
+        self.turn_index.append(len(self.commands))
+
+        if index:
+            self.play()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "Replay":
+        return cls(read_history(path), **kwargs)
+
+    def _load(self, records: Iterable[Dict]):
+        pending = None  # assistant text from histories that predate recorded commands
+        for record in records:
+            role = record["role"]
+            if role == "meta":
+                self.seed = record.get("seed")
+            elif role == "assistant":
+                pending = [re.findall(r'\w+', line) for line in split_commands(record["content"])]
+                pending = [words for words in pending if words]
+            elif role == "system":
+                turn = record.get("turn", len(self.commands))
+                if "command" in record:
+                    self.commands.append((turn, record["command"].split(), record["content"]))
+                elif pending:
+                    self.commands.append((turn, pending.pop(0), record["content"]))
+                elif not self.commands and not self.opening:
+                    self.opening = record["content"]
+
+    @property
+    def last_turn(self) -> int:
+        return len(self.turn_index) - 2
+
+    def new_game(self) -> Game:
+        return new_game(self.seed)
+
+    def _snapshot(self, position: int, game: Game):
+        if position % self.snapshot_every == 0 and position not in self.snapshots:
+            self.snapshots[position] = pickle.dumps(game)
+
+    def _restore(self, position: int) -> Tuple[int, Game]:
+        """
+        Load the latest snapshot at or before position
+        """
+        taken = sorted(self.snapshots)
+        i = bisect.bisect_right(taken, position) - 1
+        if i < 0:
+            return 0, self.new_game()
+        start = taken[i]
+        return start, pickle.loads(self.snapshots[start])
+
+    def play(self, until: Optional[int] = None, verify: bool = False, output=None) -> Tuple[Game, List[int]]:
+        """
+        Replay commands from the start of the game
+
+        Args:
+            until (int): stop before this command position, defaults to the end
+            verify (bool): compare each output with the recording
+            output: optional output backend to redraw the game text on
+
+        Returns:
+            Tuple[Game, List[int]]: the game state and the positions whose output differed
+        """
+        until = len(self.commands) if until is None else until
+        mismatches = []
+        game = self.new_game()
+        if output is not None:
+            output.write(game.output)
+
+        for position in range(until):
+            self._snapshot(position, game)
+            turn, words, recorded = self.commands[position]
+            result = game.do_command(words)
+            if verify and result != recorded:
+                mismatches.append(position)
+            if output is not None:
+                output.write(f"> {' '.join(words)}\n\n")
+                output.write(result)
+
+        self._snapshot(until, game)
+        return game, mismatches
+
+    def seek(self, turn: int) -> Game:
+        """
+        Rebuild the game state as it was at the start of a turn
+        """
+        turn = max(0, min(turn, len(self.turn_index) - 1))
+        position = self.turn_index[turn]
+        start, game = self._restore(position)
+        for i in range(start, position):
+            self._snapshot(i, game)
+            game.do_command(self.commands[i][1])
+        self._snapshot(position, game)
+        return game
+
+    def verify(self) -> List[int]:
+        """
+        Replay the whole game and return the command positions whose output
+        differs from the recording
+        """
+        _, mismatches = self.play(verify=True)
+        return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog="AdventureGPT replay",
+        description="Replay a recorded AdventureGPT game without calling the LLM"
+    )
+    parser.add_argument("history_path")
+    parser.add_argument("--verify", action="store_true",
+                        help="check that the engine reproduces the recorded output")
+    parser.add_argument("--turn", type=int, help="rebuild the game at this turn and print where the player is")
+    parser.add_argument("-d", "--display", choices=OUTPUT_BACKENDS.keys(),
+                        help="redraw the game text, e.g. with the baud effect for recordings")
+    args = parser.parse_args()
+
+    # only seeking needs the snapshots
+    replay = Replay.from_file(args.history_path, index=args.turn is not None)
+
+    if args.display:
+        output = make_output(args.display)
+        replay.play(output=output)
+        output.close()
+
+    if args.verify:
+        start = time.perf_counter()
+        mismatches = replay.verify()
+        elapsed = time.perf_counter() - start
+        print(f"replayed {len(replay.commands)} commands over {replay.last_turn} turns in {elapsed:.3f}s")
+        if mismatches:
+            print(f"{len(mismatches)} outputs differ from the recording, first at turn {replay.commands[mismatches[0]][0]}")
+        else:
+            print("all outputs match the recording")
+
+    if args.turn is not None:
+        game = replay.seek(args.turn)
+        print(game.loc.long_description if getattr(game, 'loc', None) else game.output)
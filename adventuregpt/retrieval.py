@@ -0,0 +1,146 @@
+"""
+Local retrieval over everything the game has shown the player
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import heapq
+import math
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from adventuregpt.rules import FILLER_WORDS
+
+# words that say nothing about where the player is or what is there
+STOP_WORDS = FILLER_WORDS | {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "here", "in", "is", "it",
+    "of", "on", "or", "that", "the", "there", "this", "to", "with", "you", "your", "youre",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [w for w in re.findall(r"[a-z]+", text.lower().replace("'", "")) if w not in STOP_WORDS]
+
+
+class ObservationIndex:
+    """
+    Hashed TF-IDF vectors of past game outputs in an inverted index. Each
+    distinct output keeps only the hashed terms it contains, and each term a
+    posting list of the outputs containing it, so a search only touches the
+    outputs that share a term with the query. Term counts are stored and
+    weighted by the current document frequencies at query time, so adding an
+    observation never touches the outputs already indexed.
+    """
+
+    def __init__(self, dim: int = 2 ** 11, max_chars: int = 300):
+        self.dim = dim
+        self.max_chars = max_chars
+        self.vectors: List[Dict[int, float]] = []
+        self.postings: Dict[int, List[int]] = defaultdict(list)
+        self.texts: List[str] = []
+        self.turns: List[int] = []
+        self.rows: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __setstate__(self, state: dict):
+        if "tf" in state:
+            # checkpoints from before the index was inverted hold a dense matrix
+            tf = state.pop("tf")
+            del state["df"]
+            state["vectors"] = [
+                {int(term): float(row[term]) for term in row.nonzero()[0]} for row in tf[:len(state["texts"])]
+            ]
+            state["postings"] = defaultdict(list)
+            for row, vector in enumerate(state["vectors"]):
+                for term in vector:
+                    state["postings"][term].append(row)
+        self.__dict__.update(state)
+
+    def _vector(self, text: str) -> Dict[int, float]:
+        counts = defaultdict(int)
+        for word in tokenize(text):
+            # crc32 rather than hash() so vectors are the same in every process
+            counts[zlib.crc32(word.encode()) % self.dim] += 1
+        # sublinear term frequency
+        return {term: math.log1p(count) for term, count in counts.items()}
+
+    def _idf(self, term: int, n: int) -> float:
+        return math.log((n + 1) / (len(self.postings.get(term, ())) + 1)) + 1
+
+    def add(self, text: str, turn: int):
+        """
+        Index a game output. Outputs seen before just move to the latest turn.
+        """
+        text = text.strip()
+        if not text:
+            return
+        if text in self.rows:
+            self.turns[self.rows[text]] = turn
+            return
+
+        vector = self._vector(text)
+        if not vector:
+            return
+
+        n = len(self.texts)
+        for term in vector:
+            self.postings[term].append(n)
+        self.vectors.append(vector)
+        self.rows[text] = n
+        self.texts.append(text)
+        self.turns.append(turn)
+
+    def search(self, query: str, k: int = 3, before_turn: int = None) -> List[Tuple[float, int, str]]:
+        """
+        Find the past outputs most similar to the query
+
+        Args:
+            query (str): e.g. the current objective
+            k (int): number of results
+            before_turn (int): only return outputs last seen before this turn
+
+        Returns:
+            List[Tuple[float, int, str]]: (score, turn, text), best first
+        """
+        n = len(self.texts)
+        q = self._vector(query)
+        if not n or not q:
+            return []
+
+        idf = {term: self._idf(term, n) for term in q}
+        q_weights = {term: count * idf[term] for term, count in q.items()}
+
+        # dot products with the query, over the outputs sharing a term with it
+        dots = defaultdict(float)
+        for term, weight in q_weights.items():
+            for row in self.postings.get(term, ()):
+                if before_turn is None or self.turns[row] < before_turn:
+                    dots[row] += self.vectors[row][term] * idf[term] * weight
+
+        q_norm = math.sqrt(sum(w * w for w in q_weights.values()))
+        scores = []
+        for row, dot in dots.items():
+            vector = self.vectors[row]
+            norm = math.sqrt(sum((count * self._idf(term, n)) ** 2 for term, count in vector.items()))
+            scores.append((dot / max(norm * q_norm, 1e-9), row))
+
+        return [
+            (score, self.turns[row], self.texts[row][:self.max_chars])
+            for score, row in heapq.nlargest(k, scores, key=lambda item: (item[0], -item[1]))
+            if score > 0
+        ]
+
+    def recall(self, query: str, k: int = 3, before_turn: int = None) -> str:
+        """
+        Search results formatted for a prompt
+        """
+        return "\n".join(
+            f"- (turn {turn}) {' '.join(text.split())}"
+            for _, turn, text in self.search(query, k, before_turn)
+        )
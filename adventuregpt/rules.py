@@ -0,0 +1,114 @@
+"""
+Rule-based task completion checks that read the game engine's state directly
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import re
+from typing import List, Optional
+
+from adventure.game import Game
+from adventure.model import Room
+
+from adventuregpt.collections import normalize_task_name
+
+
+TAKE_VERBS = {"take", "get", "grab", "pick", "collect", "carry", "acquire", "obtain", "retrieve"}
+DROP_VERBS = {"drop", "discard", "release"}
+LIGHT_VERBS = {"light", "ignite"}
+EXTINGUISH_VERBS = {"extinguish", "douse"}
+OPEN_VERBS = {"open", "unlock"}
+CLOSE_VERBS = {"close", "lock", "shut"}
+GO_VERBS = {"go", "enter", "reach", "return", "walk", "head", "travel", "proceed", "visit"}
+FIND_VERBS = {"find", "locate"}
+
+# objects whose prop is 0 when closed and non-zero when open
+OPENABLE = {"grate"}
+
+# "put the bird in the cage" is about where things end up, which the rules can't see
+PLACEMENT_WORDS = {"in", "into", "inside", "on", "onto"}
+
+# words that tell us nothing about which room is meant
+FILLER_WORDS = {"go", "back", "into", "inside", "in", "of", "room", "area", "location", "and", "then"}
+
+
+def find_objects(game: Game, words: List[str]) -> list:
+    """
+    Resolve the nouns in a list of words to game objects, using the same
+    five letter truncation the engine's parser accepts
+    """
+    objects = []
+    for word in words:
+        vocab = game.vocabulary.get(word) or game.vocabulary.get(word[:5])
+        if vocab is not None and vocab.kind == 'noun':
+            obj = game.referent(vocab)
+            if obj is not None and obj not in objects:
+                objects.append(obj)
+    return objects
+
+
+def room_matches(room: Room, words: List[str]) -> bool:
+    """
+    Whether every descriptive word of the objective appears in the room's
+    short description. Long descriptions mention neighbouring places too
+    ("A ROAD BEFORE A SMALL BRICK BUILDING") so they are not trusted.
+    """
+    wanted = [w for w in words if w not in FILLER_WORDS]
+    if not wanted or not room.short_description:
+        return False
+    description = set(re.findall(r'\w+', room.short_description.lower()))
+    return all(w in description or w.rstrip('s') in description for w in wanted)
+
+
+def check_completion(game: Game, objective: str) -> Optional[bool]:
+    """
+    Decide whether an objective has been completed by inspecting the game
+
+    Args:
+        game (Game): the running game
+        objective (str): the current task
+
+    Returns:
+        Optional[bool]: True or False when a rule could decide, None when the
+        objective needs the TaskCompletionAgent
+    """
+    if not objective or getattr(game, 'loc', None) is None:
+        return None
+
+    words = normalize_task_name(objective).split()
+    if not words:
+        return None
+
+    verb, rest = words[0], words[1:]
+    if verb in ("turn", "switch") and rest and rest[0] in ("on", "off"):
+        verb, rest = ("light" if rest[0] == "on" else "extinguish"), rest[1:]
+
+    if verb not in GO_VERBS and PLACEMENT_WORDS.intersection(rest):
+        return None
+
+    objects = find_objects(game, rest)
+
+    if verb in TAKE_VERBS and objects:
+        return all(obj.is_toting for obj in objects)
+
+    if verb in DROP_VERBS and objects:
+        return not any(obj.is_toting for obj in objects)
+
+    if verb in LIGHT_VERBS | EXTINGUISH_VERBS and objects == [game.objects['lamp']]:
+        lit = game.objects['lamp'].prop == 1
+        return lit if verb in LIGHT_VERBS else not lit
+
+    if verb in OPEN_VERBS | CLOSE_VERBS and objects and all(o.names[0] in OPENABLE for o in objects):
+        is_open = all(obj.prop != 0 for obj in objects)
+        return is_open if verb in OPEN_VERBS else not is_open
+
+    if verb in FIND_VERBS and objects:
+        # finding an object is done once it is here, not finding it yet proves nothing
+        return True if all(game.is_here(obj) for obj in objects) else None
+
+    if verb in GO_VERBS and not objects and room_matches(game.loc, rest):
+        return True
+
+    return None
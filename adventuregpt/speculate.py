@@ -0,0 +1,143 @@
+"""
+Try commands out on copies of the game before playing one for real
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import pickle
+from typing import Dict, List, Optional, Set
+
+from adventure.game import Game
+
+# how much each kind of progress is worth when ranking candidate commands
+SCORE_WEIGHT = 10
+NEW_ROOM_WEIGHT = 5
+MOVED_WEIGHT = 1
+NEW_ITEM_WEIGHT = 3
+NO_EFFECT_WEIGHT = -1
+REFUSED_WEIGHT = -3
+DEATH_WEIGHT = -100
+
+# the start of the engine's replies to commands it could not carry out
+REFUSALS = ("I DON'T KNOW", "WHAT?", "I DON'T UNDERSTAND", "I SEE NO", "YOU CAN'T", "THERE IS NO WAY",
+            "YOU AREN'T CARRYING", "YOU ARE ALREADY CARRYING", "THERE IS NOTHING HERE",
+            "PLEASE ANSWER THE QUESTION")
+
+
+def snapshot(game: Game) -> bytes:
+    """
+    Freeze a game, random number generator and all, so it can be forked
+    """
+    return pickle.dumps(game, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def restore(frozen: bytes) -> Game:
+    """
+    An independent copy of a snapshotted game
+    """
+    return pickle.loads(frozen)
+
+
+def world_state(game: Game) -> tuple:
+    """
+    Where the player is, what they carry and the state of every object
+    """
+    loc = getattr(game, 'loc', None)
+    return (
+        loc.n if loc is not None else None,
+        tuple(obj.n for obj in game.inventory) if loc is not None else (),
+        tuple(obj.prop for obj in game.object_list),
+        game.is_dead,
+    )
+
+
+class Speculator:
+    """
+    Plays candidate commands on forks of the game and scores what each one did:
+    points gained, reaching a room not visited before, picking items up, and
+    penalties for dying, being refused or changing nothing at all. Forks carry
+    the game's random number generator with them, so a fork shows exactly what
+    playing the command for real would do.
+    """
+
+    def __init__(self):
+        self.visited: Set[int] = set()
+        self.stats = {"turns": 0, "candidates": 0, "screened": 0}
+
+    def visit(self, game: Game):
+        """
+        Note the room the player is in, so only other rooms count as new
+        """
+        loc = getattr(game, 'loc', None)
+        if loc is not None:
+            self.visited.add(loc.n)
+
+    def score(self, before: Game, after: Game, output: str) -> float:
+        """
+        How much a command moved the game forward, by local rules only
+        """
+        if after.deaths > before.deaths:
+            return DEATH_WEIGHT
+        value = 0
+
+        # the score and the map only mean something once the game is under way,
+        # not while it is still asking whether to show the instructions
+        old_loc, new_loc = getattr(before, 'loc', None), getattr(after, 'loc', None)
+        if old_loc is not None and new_loc is not None:
+            value += (after.compute_score()[0] - before.compute_score()[0]) * SCORE_WEIGHT
+            if new_loc.n != old_loc.n:
+                value += MOVED_WEIGHT
+                if new_loc.n not in self.visited:
+                    value += NEW_ROOM_WEIGHT
+            carried = {obj.n for obj in before.inventory}
+            value += NEW_ITEM_WEIGHT * sum(1 for obj in after.inventory if obj.n not in carried)
+
+        if output.lstrip().startswith(REFUSALS):
+            value += REFUSED_WEIGHT
+        elif world_state(before) == world_state(after):
+            value += NO_EFFECT_WEIGHT
+        return value
+
+    def evaluate(self, game: Game, candidates: List[List[str]]) -> List[Dict]:
+        """
+        Play each candidate on its own fork of the game
+
+        Args:
+            game (Game): the game as it is now, left untouched
+            candidates (List[List[str]]): command words, best first by the player's reckoning
+
+        Returns:
+            List[Dict]: per candidate, the "command", its "score" and the "output" it would get
+        """
+        frozen = snapshot(game)
+        outcomes = []
+        for words in candidates:
+            fork = restore(frozen)
+            output = fork.do_command(words)
+            outcomes.append({"command": words, "score": self.score(game, fork, output), "output": output})
+        return outcomes
+
+    def choose(self, game: Game, candidates: List[List[str]]) -> Optional[List[str]]:
+        """
+        The candidate that does the most, keeping the player's order on ties
+
+        Returns:
+            List[str]: the command to play, None when there are no candidates
+        """
+        if len(candidates) < 2:
+            return candidates[0] if candidates else None
+        outcomes = self.evaluate(game, candidates)
+        best = max(range(len(outcomes)), key=lambda i: (outcomes[i]["score"], -i))
+        self.stats["turns"] += 1
+        self.stats["candidates"] += len(candidates)
+        if best != 0:
+            self.stats["screened"] += 1
+        return outcomes[best]["command"]
+
+    def __str__(self):
+        return (
+            f"Speculation: {self.stats['candidates']} candidates tried over {self.stats['turns']} turns, "
+            f"the player's first choice was passed over {self.stats['screened']} times"
+        )
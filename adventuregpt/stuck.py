@@ -0,0 +1,92 @@
+"""
+Notice when the player is going round in circles
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import hashlib
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from adventure.game import Game
+
+# what to try, in turn, while the player stays stuck on the same task
+ESCAPES = ("explore", "skip", "replan")
+
+# shown to the player along with the game output after an escape
+STUCK_NOTE = "(You have been going round in circles. Try something different.)\n"
+
+
+def state_key(game: Game, output: str) -> bytes:
+    """
+    Hash of where the player is, what they carry and what the game just said
+    """
+    loc = getattr(getattr(game, 'loc', None), 'n', None)
+    inventory = ",".join(str(obj.n) for obj in game.inventory) if loc is not None else ""
+    text = " ".join(output.split())
+    # a stable digest rather than hash(), so checkpoints carry over between processes
+    return hashlib.blake2b(f"{loc}|{inventory}|{text}".encode(), digest_size=8).digest()
+
+
+class LoopDetector:
+    """
+    Keeps the hashes of the last window game states, with a count of each, so
+    a state coming round for the repeats-th time is spotted in O(1) per turn.
+    Each detection picks the next escape for the task the player is stuck on,
+    starting over when the task changes.
+
+    Args:
+        window (int): number of recent states to remember
+        repeats (int): how often a state has to recur within the window
+    """
+
+    def __init__(self, window: int = 12, repeats: int = 3):
+        self.window = window
+        self.repeats = repeats
+        self.recent: Deque[bytes] = deque()
+        self.counts: Dict[bytes, int] = {}
+        self.task: Optional[str] = None
+        self.level = 0
+        self.stats = {"detected": 0, **dict.fromkeys(ESCAPES, 0)}
+
+    def observe(self, game: Game, output: str) -> bool:
+        """
+        Add the state after a command
+
+        Returns:
+            bool: whether the player is stuck in a loop
+        """
+        key = state_key(game, output)
+        self.recent.append(key)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if len(self.recent) > self.window:
+            old = self.recent.popleft()
+            self.counts[old] -= 1
+            if not self.counts[old]:
+                del self.counts[old]
+
+        if self.counts[key] < self.repeats:
+            return False
+        self.stats["detected"] += 1
+        # start afresh, so the escape gets a chance to work before firing again
+        self.recent.clear()
+        self.counts.clear()
+        return True
+
+    def escape(self, task: Optional[str]) -> str:
+        """
+        The escape to try next for a task, one step further each time the
+        player is stuck on the same task, and round again after a replan
+        """
+        if task != self.task:
+            self.task = task
+            self.level = 0
+        policy = ESCAPES[self.level % len(ESCAPES)]
+        self.level += 1
+        return policy
+
+    def __str__(self):
+        escapes = ", ".join(f"{self.stats[policy]} {policy}" for policy in ESCAPES)
+        return f"Stuck loops: {self.stats['detected']} detected; escapes: {escapes}"
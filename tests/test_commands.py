@@ -0,0 +1,71 @@
+"""
+Tests for turning LLM output into game commands
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import pytest
+
+from adventuregpt.commands import CommandValidator, split_commands
+from adventuregpt.engine import new_game
+
+
+@pytest.fixture
+def validator():
+    return CommandValidator.from_game(new_game(0))
+
+
+def test_split_commands_on_newlines_and_periods():
+    assert split_commands("North.\nTake lamp") == ["north", "", "take lamp"]
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("north", ["north"]),
+    ("NORTH", ["north"]),
+    ("take lamp", ["take", "lamp"]),
+    ("I will now go north", ["north"]),
+    ("Let's take the lamp and the keys", ["take", "lamp"]),
+    ("pick up the lamp", ["take", "lamp"]),
+    ("turn on the lamp", ["light", "lamp"]),
+    ("> enter building", ["enter", "building"]),
+    ("inventory", ["inventory"]),
+])
+def test_validate_cuts_prose_down_to_a_command(validator, line, expected):
+    assert validator.validate(line) == expected
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("nort", ["north"]),
+    ("norht", ["north"]),
+    ("take lammp", ["take", "lamp"]),
+])
+def test_validate_corrects_small_typos(validator, line, expected):
+    assert validator.validate(line) == expected
+
+
+def test_validate_truncates_long_words_like_the_engine(validator):
+    assert validator.validate("take bottles") == ["take", "bottl"]
+
+
+def test_prose_words_are_not_corrected_into_game_words(validator):
+    # "will" is one letter from "fill"
+    assert validator.validate("I will") is None
+
+
+def test_lines_without_game_words_are_dropped(validator):
+    assert validator.validate("Hmm, let me think about this") is None
+    assert validator.validate("") is None
+    assert validator.stats["dropped"] == 2
+
+
+def test_yes_no_answers_only_count_while_the_game_asks(validator):
+    assert validator.validate("No thanks, I don't need instructions", yesno=True) == ["no"]
+    assert validator.validate("yes", yesno=True) == ["yes"]
+
+
+def test_stats_count_corrections(validator):
+    validator.validate("north")
+    validator.validate("I will now go north")
+    assert validator.stats == {"commands": 2, "corrected": 1, "dropped": 0}
@@ -0,0 +1,89 @@
+"""
+Tests for the LLM call limiter
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import asyncio
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from adventuregpt.ratelimit import RateLimiter
+
+
+class Peak:
+    """
+    Stand-in for an LLM call that records how many calls ran at once
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def enter(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def exit(self):
+        with self.lock:
+            self.running -= 1
+
+    def call(self):
+        self.enter()
+        time.sleep(0.02)
+        self.exit()
+
+    async def acall(self):
+        self.enter()
+        await asyncio.sleep(0.02)
+        self.exit()
+
+
+def test_sync_calls_are_capped():
+    limiter = RateLimiter(max_concurrent=2)
+    peak = Peak()
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        list(pool.map(lambda _: limiter.run(peak.call), range(12)))
+
+    assert peak.peak == 2
+    assert limiter.stats()["calls"] == 12
+
+
+def test_async_calls_are_capped():
+    limiter = RateLimiter(max_concurrent=2)
+    peak = Peak()
+
+    async def main():
+        await asyncio.gather(*(limiter.arun(peak.acall) for _ in range(8)))
+
+    asyncio.run(main())
+    assert peak.peak == 2
+
+
+def test_sync_and_async_calls_share_the_cap():
+    limiter = RateLimiter(max_concurrent=2)
+    peak = Peak()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            threads = [loop.run_in_executor(pool, limiter.run, peak.call) for _ in range(4)]
+            await asyncio.gather(*threads, *(limiter.arun(peak.acall) for _ in range(4)))
+
+    asyncio.run(main())
+    assert peak.peak == 2
+
+
+def test_a_pickled_limiter_gets_its_own_slots():
+    limiter = RateLimiter(max_concurrent=1)
+    copy = pickle.loads(pickle.dumps(limiter))
+
+    with limiter.slots:
+        # the original's slot is taken, the copy's is free
+        assert copy.run(lambda: "called") == "called"
@@ -0,0 +1,74 @@
+"""
+Tests for replaying recorded games
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import pytest
+from adventure.game import Game
+
+from adventuregpt.engine import new_game
+from adventuregpt.providers import PLAYER_SCRIPT
+from adventuregpt.replay import Replay
+
+SEED = 3
+
+
+@pytest.fixture(scope="module")
+def records():
+    """
+    A history of the scripted opening, played twice over, one command a turn
+    """
+    game = new_game(SEED)
+    records = [{"role": "meta", "content": "", "seed": SEED}, {"role": "system", "content": game.output, "turn": 0}]
+    for turn, command in enumerate(PLAYER_SCRIPT * 2, 1):
+        records.append({"role": "assistant", "content": command, "turn": turn})
+        output = game.do_command(command.split())
+        records.append({"role": "system", "content": output, "turn": turn, "command": command})
+    return records
+
+
+def count_commands(monkeypatch) -> list:
+    calls = []
+    do_command = Game.do_command
+
+    def counted(game, words):
+        calls.append(words)
+        return do_command(game, words)
+
+    monkeypatch.setattr(Game, "do_command", counted)
+    return calls
+
+
+def test_replay_matches_the_recording(records):
+    assert Replay(records, index=False).verify() == []
+
+
+def test_seek_on_a_fresh_replay_restores_a_snapshot(records, monkeypatch):
+    replay = Replay(records, snapshot_every=10)
+    calls = count_commands(monkeypatch)
+
+    game = replay.seek(48)
+
+    assert len(calls) < replay.snapshot_every
+    expected, _ = Replay(records, index=False).play(until=replay.turn_index[48])
+    assert game.loc.n == expected.loc.n
+    assert [obj.n for obj in game.inventory] == [obj.n for obj in expected.inventory]
+
+
+def test_seek_without_an_index_snapshots_as_it_goes(records, monkeypatch):
+    replay = Replay(records, snapshot_every=10, index=False)
+    replay.seek(48)
+    calls = count_commands(monkeypatch)
+
+    replay.seek(45)
+
+    assert len(calls) < replay.snapshot_every
+
+
+def test_seek_clamps_to_the_recorded_turns(records):
+    replay = Replay(records)
+    assert replay.seek(10 ** 6).turns == replay.seek(replay.last_turn + 1).turns
+    assert replay.seek(-5).output == new_game(SEED).output
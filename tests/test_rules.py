@@ -0,0 +1,84 @@
+"""
+Tests for deciding task completion from the game state
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import pytest
+
+from adventuregpt.engine import new_game
+from adventuregpt.rules import check_completion
+
+
+def play(*commands):
+    game = new_game(0)
+    for command in ("no",) + commands:
+        game.do_command(command.split())
+    return game
+
+
+@pytest.fixture
+def road():
+    return play()
+
+
+@pytest.fixture
+def building():
+    return play("enter building")
+
+
+def test_nothing_to_decide_before_the_game_starts():
+    assert check_completion(new_game(0), "Take the lamp") is None
+
+
+def test_unknown_objectives_are_left_to_the_llm(road):
+    assert check_completion(road, "") is None
+    assert check_completion(road, "Explore the forest") is None
+    assert check_completion(road, "Go up") is None
+
+
+def test_take(building):
+    assert check_completion(building, "Take the lamp") is False
+    building.do_command(["take", "lamp"])
+    assert check_completion(building, "Take the lamp") is True
+    assert check_completion(building, "Pick up the lamp") is True
+    assert check_completion(building, "Take the lamp and the keys") is False
+
+
+def test_drop(building):
+    building.do_command(["take", "lamp"])
+    assert check_completion(building, "Put down the lamp") is False
+    building.do_command(["drop", "lamp"])
+    assert check_completion(building, "Drop the lamp") is True
+    assert check_completion(building, "Put down the lamp") is True
+
+
+@pytest.mark.parametrize("objective", ["Put the bird in the cage", "Put the lamp into the bottle"])
+def test_placing_things_is_left_to_the_llm(building, objective):
+    assert check_completion(building, objective) is None
+    building.do_command(["take", "lamp"])
+    assert check_completion(building, objective) is None
+
+
+def test_light(building):
+    building.do_command(["take", "lamp"])
+    assert check_completion(building, "Light the lamp") is False
+    building.do_command(["light", "lamp"])
+    assert check_completion(building, "Turn on the lamp") is True
+    assert check_completion(building, "Turn off the lamp") is False
+
+
+def test_open_grate(road):
+    assert check_completion(road, "Unlock the grate") is False
+
+
+def test_find(road, building):
+    assert check_completion(road, "Find the keys") is None
+    assert check_completion(building, "Find the keys") is True
+
+
+def test_go(road, building):
+    assert check_completion(road, "Enter the building") is None
+    assert check_completion(building, "Go inside the building") is True
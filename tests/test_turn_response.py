@@ -0,0 +1,78 @@
+"""
+Tests for parsing the TurnAgent's replies
+
+Copyright 2023 Lily Hughes-Robinson.
+
+Licensed as free software under the
+Apache License, Version 2.0 as detailed in the accompanying README.txt.
+"""
+import pytest
+
+from adventuregpt.chain import parse_task_items, parse_turn_response, parse_verdict
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("yes", True),
+    ("COMPLETE", True),
+    ("true.", True),
+    ("no", False),
+    ("INCOMPLETE", False),
+    ("Not yet, the lamp is still here", False),
+    ("", None),
+    ("maybe", None),
+])
+def test_parse_verdict(text, expected):
+    assert parse_verdict(text) is expected
+
+
+def test_parse_task_items_skips_none_and_plain_lines():
+    lines = ["1. Unlock the grate", "- Find the bird!", "none", "2) none", "just some text"]
+    assert parse_task_items(lines) == [{"task_name": "Unlock the grate"}, {"task_name": "Find the bird"}]
+
+
+def test_parse_turn_response_plain_headings():
+    turn = parse_turn_response("COMPLETE: no\nNEW TASKS:\n1. Unlock the grate\n2. Find the bird\nCOMMAND: south")
+    assert turn == {
+        "complete": False,
+        "new_tasks": [{"task_name": "Unlock the grate"}, {"task_name": "Find the bird"}],
+        "command": "south",
+    }
+
+
+def test_parse_turn_response_markdown_headings_in_any_order():
+    response = (
+        "**Command:** `take lamp`\n"
+        "## Objective complete: yes\n"
+        "### New tasks:\n"
+        "- none\n"
+    )
+    assert parse_turn_response(response) == {"complete": True, "new_tasks": [], "command": "take lamp"}
+
+
+def test_parse_turn_response_command_on_the_lines_after_its_heading():
+    turn = parse_turn_response("complete: no\ncommands:\n1. enter building\n2. \"take lamp\"")
+    assert turn["command"] == "enter building\ntake lamp"
+
+
+def test_parse_turn_response_json():
+    response = '```json\n{"complete": true, "new_tasks": ["Unlock the grate"], "command": "south"}\n```'
+    assert parse_turn_response(response) == {
+        "complete": True,
+        "new_tasks": [{"task_name": "Unlock the grate"}],
+        "command": "south",
+    }
+
+
+def test_parse_turn_response_json_with_string_fields():
+    turn = parse_turn_response('{"Objective_Complete": "no", "tasks": "Find the bird", "next_command": ["west"]}')
+    assert turn == {"complete": False, "new_tasks": [{"task_name": "Find the bird"}], "command": "west"}
+
+
+def test_parse_turn_response_bare_command():
+    assert parse_turn_response("north") == {"complete": None, "new_tasks": [], "command": "north"}
+
+
+def test_parse_turn_response_missing_verdict():
+    turn = parse_turn_response("NEW TASKS:\nnone\nCOMMAND: look")
+    assert turn["complete"] is None
+    assert turn["command"] == "look"